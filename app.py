@@ -6,203 +6,502 @@ Análisis de predicciones NIR de diferentes lámparas
 import streamlit as st
 import pandas as pd
 import numpy as np
-import xml.etree.ElementTree as ET
-import plotly.graph_objects as go
-import plotly.express as px
-from plotly.subplots import make_subplots
+try:
+    from lxml import etree as ET
+    HAS_LXML = True
+except ImportError:
+    import xml.etree.ElementTree as ET
+    HAS_LXML = False
 import io
+import hashlib
+from functools import lru_cache
+from itertools import cycle, islice
 from datetime import datetime
 from buchi_streamlit_theme import apply_buchi_styles, BUCHI_COLORS
+from config import PLOTLY_TEMPLATE
 
 
-class NIRAnalyzer:
-    """Clase para analizar datos NIR desde archivos XML"""
+# Namespace del XML de NIR-Online (formato Excel 2003 XML)
+SS_NAMESPACE = 'urn:schemas-microsoft-com:office:spreadsheet'
+NS = {'ss': SS_NAMESPACE}
+SS = f'{{{SS_NAMESPACE}}}'
+WORKSHEET_TAG = SS + 'Worksheet'
+ROW_TAG = SS + 'Row'
+CELL_TAG = SS + 'Cell'
+DATA_TAG = SS + 'Data'
+NAME_ATTR = SS + 'Name'
+
+# Etiquetas de las filas de estadísticas que cierran la tabla de datos
+STATS_ROW_LABELS = frozenset({'Average', 'Min', 'Max', 'Std.Dev.', 'Target'})
+
+# Columnas de texto que no se convierten a numérico
+NON_NUMERIC_COLUMNS = frozenset({'No', 'ID', 'Note', 'Product', 'Method', 'Unit'})
+
+# Columnas de metadatos que no son parámetros de predicción
+META_COLUMNS = frozenset({'No', 'ID', 'Note', 'Product', 'Method', 'Unit', 'Begin', 'End', 'Length'})
+
+# A partir de este número de puntos los scatter se dibujan con WebGL
+SCATTERGL_MIN_POINTS = 1000
+
+# Máximo de puntos por subplot que se envían al navegador en los scatter
+SCATTER_MAX_POINTS = 2000
+
+# A partir de este número de muestras las cajas se envían precalculadas
+BOX_PRECOMPUTE_MIN_POINTS = 100
+
+# Archivos XML cuyo analizador (DataFrames incluidos) se mantiene en memoria
+ANALYZER_CACHE_ENTRIES = 4
+
+# Figuras Plotly que guarda cada constructor de gráficos (por selección)
+FIGURE_CACHE_ENTRIES = 32
+
+# Selecciones (datos filtrados, estadísticas, ejes) que se guardan en caché
+SELECTION_CACHE_ENTRIES = 8
+
+# Gráficos del reporte HTML ya exportados (uno por parámetro y análisis)
+CHART_HTML_CACHE_ENTRIES = 128
+
+# Líneas del reporte de texto que se muestran por página en la pestaña de reporte
+REPORT_PAGE_LINES = 2000
+
+# Estadísticos por parámetro y lámpara (en este orden) calculados con groupby.agg
+STATS_AGG = ('mean', 'std', 'min', 'max', 'count')
+
+# Claves de las estadísticas por lámpara que no son parámetros
+NON_PARAM_KEYS = frozenset({'n', 'note'})
+
+# Evaluación de la diferencia relativa entre lámparas: límites (%) y, por
+# tramo, (evaluación, color del texto, color de fondo de la fila)
+_EVAL_BOUNDS = (2.0, 5.0, 10.0)
+_EVAL_TABLE = (
+    ('🟢 Excelente', '#4caf50', '#e8f5e9'),
+    ('🟡 Aceptable', '#ffc107', '#fff3e0'),
+    ('🟠 Revisar', '#ff9800', '#ffebee'),
+    ('🔴 Significativo', '#f44336', '#ffebee'),
+)
+
+# Consultas XPath precompiladas (lxml las evalúa en C)
+if HAS_LXML:
+    CELL_XP = ET.XPath('./ss:Cell', namespaces=NS)
+    DATA_XP = ET.XPath('./ss:Data/text()', namespaces=NS, smart_strings=False)
+
+    def _iterparse(source):
+        """Eventos start/end solo para Worksheet y Row"""
+        return ET.iterparse(source, events=('start', 'end'), tag=(WORKSHEET_TAG, ROW_TAG))
+
+    def _release(elem):
+        """Libera un elemento ya procesado y sus hermanos anteriores"""
+        elem.clear()
+        while elem.getprevious() is not None:
+            del elem.getparent()[0]
+else:
+    # Sin lxml: búsquedas por tag completo, sin resolver prefijos de namespace
+    def CELL_XP(row):
+        return row.findall(CELL_TAG)
+
+    def DATA_XP(cell):
+        data_elem = cell.find(DATA_TAG)
+        return [data_elem.text] if data_elem is not None and data_elem.text is not None else []
+
+    def _iterparse(source):
+        """Eventos start/end solo para Worksheet y Row"""
+        for event, elem in ET.iterparse(source, events=('start', 'end')):
+            if elem.tag in (WORKSHEET_TAG, ROW_TAG):
+                yield event, elem
+
+    def _release(elem):
+        """Libera un elemento ya procesado"""
+        elem.clear()
+
+
+def _parse_nir_bytes(content):
+    """
+    Parsea el contenido de un XML de NIR-Online.
     
-    def __init__(self):
-        self.data = {}
-        self.products = []
-        self.sensor_serial = None
-        
-    def parse_xml(self, uploaded_file):
-        """Parse XML file from NIR-Online software"""
-        try:
-            # Leer el contenido del archivo
-            content = uploaded_file.read()
-            
-            # Parse XML
-            root = ET.fromstring(content)
-            
-            # Namespace del XML
-            ns = {'ss': 'urn:schemas-microsoft-com:office:spreadsheet'}
-            
-            # Variable para almacenar el número de serie del sensor
-            sensor_serial = None
-            
-            # Encontrar todas las worksheets (productos)
-            worksheets = root.findall('.//ss:Worksheet', ns)
-            
-            for worksheet in worksheets:
-                product_name = worksheet.get('{urn:schemas-microsoft-com:office:spreadsheet}Name')
-                
+    No se cachea aquí: load_analyzer ya guarda el analizador (con sus
+    DataFrames) por archivo, y una segunda caché duplicaría los datos.
+    
+    Returns:
+        tuple: (data, products, sensor_serial)
+    """
+    data = {}
+    products = []
+    
+    # Variable para almacenar el número de serie del sensor
+    sensor_serial = None
+    
+    # Estado de la worksheet (producto) en curso
+    product_name = None
+    skip_sheet = True
+    headers = []
+    data_rows = []
+    start_data = False
+    end_data = False
+    
+    # Recorrer el XML en streaming: cada fila se procesa y se libera
+    for event, elem in _iterparse(io.BytesIO(content)):
+        if elem.tag == WORKSHEET_TAG:
+            if event == 'start':
+                product_name = elem.get(NAME_ATTR)
                 # Saltar hojas que no son productos
-                if product_name in ['Espectros', 'Summary'] or product_name is None:
-                    continue
-                
-                # Extraer datos de la tabla
-                table = worksheet.find('.//ss:Table', ns)
-                if table is None:
-                    continue
-                
-                rows = table.findall('.//ss:Row', ns)
-                
-                # Encontrar la fila de encabezado
+                skip_sheet = product_name in ['Espectros', 'Summary'] or product_name is None
                 headers = []
                 data_rows = []
                 start_data = False
+                end_data = False
+                continue
+            
+            # Crear DataFrame al cerrar la worksheet
+            if not skip_sheet and headers and data_rows:
+                # Volcar las filas en una matriz del ancho del encabezado
+                # (las celdas que faltan quedan a None)
+                max_len = len(headers)
+                values = np.empty((len(data_rows), max_len), dtype=object)
+                for row_idx, row in enumerate(data_rows):
+                    row = row[:max_len]
+                    values[row_idx, :len(row)] = row
                 
-                for row in rows:
-                    cells = row.findall('.//ss:Cell', ns)
-                    row_data = []
-                    
-                    for cell in cells:
-                        data_elem = cell.find('.//ss:Data', ns)
-                        if data_elem is not None:
-                            row_data.append(data_elem.text)
-                        else:
-                            row_data.append(None)
-                    
-                    # Detectar fila de encabezado
-                    # Buscar fila que contenga las columnas clave: ID, Note, Product
-                    if (not start_data and row_data and 
-                        'ID' in row_data and 'Note' in row_data and 
-                        ('Product' in row_data or 'Method' in row_data)):
-                        headers = row_data
-                        # Normalizar el nombre de la primera columna a "No"
-                        if headers[0] in ['#', 'No']:
-                            headers[0] = 'No'
-                        start_data = True
-                        continue
-                    
-                    # Recoger filas de datos (antes de "Average", "Min", "Max", etc.)
-                    if start_data and row_data:
-                        # Verificar si es una fila de datos (primera columna es número)
-                        if row_data[0] and str(row_data[0]).replace('.', '').isdigit():
-                            data_rows.append(row_data)
-                            
-                            # Extraer número de serie del sensor (columna Unit) de la primera fila
-                            if sensor_serial is None and 'Unit' in headers:
-                                unit_idx = headers.index('Unit')
-                                if unit_idx < len(row_data) and row_data[unit_idx]:
-                                    sensor_serial = row_data[unit_idx]
-                        # Verificar si llegamos a las filas de estadísticas
-                        elif len(row_data) > 1 and row_data[1] in ['Average', 'Min', 'Max', 'Std.Dev.', 'Target']:
-                            break
+                df = pd.DataFrame(values, columns=headers)
+                
+                # Quedarse con las filas de datos (primera columna numérica)
+                df = df[pd.to_numeric(df.iloc[:, 0], errors='coerce').notna()].reset_index(drop=True)
                 
-                # Crear DataFrame
-                if headers and data_rows:
-                    # Asegurar que todas las filas tengan la misma longitud
-                    max_len = len(headers)
-                    data_rows = [row + [None] * (max_len - len(row)) if len(row) < max_len else row[:max_len] 
-                                for row in data_rows]
+                if not df.empty:
+                    # Extraer número de serie del sensor (columna Unit) de la primera fila
+                    if sensor_serial is None and 'Unit' in headers:
+                        units = df.iloc[:, headers.index('Unit')].dropna()
+                        if not units.empty:
+                            sensor_serial = units.iloc[0]
                     
-                    df = pd.DataFrame(data_rows, columns=headers)
+                    # Convertir columnas numéricas (todas en una sola llamada). Se
+                    # mantienen en float64: en float32 valores del XML como 10.3
+                    # dejarían de ser exactos en estadísticas, gráficos e informes
+                    numeric_cols = [col for col in df.columns if col not in NON_NUMERIC_COLUMNS]
+                    df[numeric_cols] = df[numeric_cols].apply(pd.to_numeric, errors='coerce')
                     
-                    # Convertir columnas numéricas
-                    for col in df.columns:
-                        if col not in ['No', 'ID', 'Note', 'Product', 'Method', 'Unit']:
-                            try:
-                                df[col] = pd.to_numeric(df[col], errors='coerce')
-                            except:
-                                pass
+                    # ID y Note como categorías: agrupar y filtrar trabaja sobre códigos enteros.
+                    # Product (igual en toda la hoja) también, para no repetir el texto por fila
+                    df['ID'] = df['ID'].astype('category')
+                    df['Note'] = df['Note'].astype('category')
+                    if 'Product' in df.columns:
+                        df['Product'] = df['Product'].astype('category')
                     
-                    self.data[product_name] = df
-                    self.products.append(product_name)
+                    data[product_name] = df
+                    products.append(product_name)
             
-            # Guardar el número de serie del sensor
-            self.sensor_serial = sensor_serial
+            _release(elem)
+            continue
+        
+        # Filas: solo interesan al cerrarse (con todas sus celdas)
+        if event != 'end':
+            continue
+        
+        if skip_sheet or end_data:
+            _release(elem)
+            continue
+        
+        row_data = []
+        
+        for cell in CELL_XP(elem):
+            data_text = DATA_XP(cell)
+            row_data.append(data_text[0] if data_text else None)
+        
+        _release(elem)
+        
+        # Detectar fila de encabezado
+        # Buscar fila que contenga las columnas clave: ID, Note, Product
+        if (not start_data and row_data and 
+            'ID' in row_data and 'Note' in row_data and 
+            ('Product' in row_data or 'Method' in row_data)):
+            headers = row_data
+            # Normalizar el nombre de la primera columna a "No"
+            if headers[0] in ['#', 'No']:
+                headers[0] = 'No'
+            start_data = True
+            continue
+        
+        # Recoger filas de datos (antes de "Average", "Min", "Max", etc.)
+        # Las filas no numéricas se descartan al crear el DataFrame
+        if start_data and row_data:
+            # Verificar si llegamos a las filas de estadísticas
+            if len(row_data) > 1 and row_data[1] in STATS_ROW_LABELS:
+                end_data = True
+            else:
+                data_rows.append(row_data)
+    
+    return data, tuple(products), sensor_serial
+
+
+def flatten_stats(stats):
+    """
+    Pasar las estadísticas anidadas a una tabla larga (una fila por producto,
+    lámpara y parámetro) con columnas product, lamp, param, n, mean, std,
+    min y max.
+    """
+    return pd.DataFrame.from_records(
+        [
+            (product, lamp, param, lamp_stats['n'],
+             param_stats['mean'], param_stats['std'], param_stats['min'], param_stats['max'])
+            for product, product_stats in stats.items()
+            for lamp, lamp_stats in product_stats.items()
+            for param, param_stats in lamp_stats.items()
+            if param not in NON_PARAM_KEYS
+        ],
+        columns=['product', 'lamp', 'param', 'n', 'mean', 'std', 'min', 'max']
+    )
+
+
+class NIRStats(dict):
+    """
+    Estadísticas por producto y lámpara: {producto: {lámpara: {...}}}.
+    
+    Se usa como un dict normal; además guarda, para no recalcularlos en
+    cada gráfico:
+        all_lamps: lista ordenada de todas las lámparas
+        lamp_params: {producto: {lámpara: (parámetros...)}}
+        product_params: {producto: [parámetros]}, en orden de aparición
+        param_to_products: {parámetro: [productos con datos]}, en el
+            orden de los productos
+        stats_df: las mismas estadísticas en formato largo (flatten_stats)
+        key: huella de los datos y el filtro de los que salen, usada
+            como clave de las cachés de gráficos
+    """
+    
+    def __init__(self, stats, key=None):
+        super().__init__(stats)
+        self.key = key
+        
+        lamps = set()
+        self.lamp_params = {}
+        self.product_params = {}
+        self.param_to_products = {}
+        for product, product_stats in stats.items():
+            lamps.update(product_stats.keys())
+            
+            lamp_params = {
+                lamp: tuple(k for k in lamp_stats if k not in NON_PARAM_KEYS)
+                for lamp, lamp_stats in product_stats.items()
+            }
+            product_params = list(dict.fromkeys(p for params in lamp_params.values() for p in params))
+            self.lamp_params[product] = lamp_params
+            self.product_params[product] = product_params
+            for param in product_params:
+                self.param_to_products.setdefault(param, []).append(product)
+        
+        # Se toma de las claves y no de stats_df['lamp'].unique(): stats_df solo
+        # tiene filas por parámetro y perdería las lámparas sin valores numéricos
+        self.all_lamps = sorted(lamps)
+        self.stats_df = flatten_stats(stats)
+
+
+@st.cache_data(show_spinner=False, max_entries=SELECTION_CACHE_ENTRIES)
+def _gather_axes(data_key, products, _data):
+    """
+    IDs y Notes únicos (ordenados) de los productos seleccionados.
+    
+    Cacheado según la huella del archivo (data_key) y los productos, para
+    no recorrer los DataFrames en cada rerun; _data no se hashea.
+    """
+    frames = [_data[product] for product in products if product in _data]
+    
+    if not frames:
+        return [], []
+    
+    def _unique_sorted(col):
+        # Únicos sobre los valores de todos los productos concatenados
+        values = pd.unique(np.concatenate([df[col].to_numpy() for df in frames]))
+        return sorted(values[~pd.isna(values)].tolist())
+    
+    return _unique_sorted('ID'), _unique_sorted('Note')
+
+
+@st.cache_data(show_spinner=False, max_entries=SELECTION_CACHE_ENTRIES)
+def _filter_data(data_key, products, id_note_combinations, _data):
+    """
+    Filtrar datos por productos y combinaciones ID-Note.
+    
+    Cacheado según la huella del archivo (data_key) y la selección;
+    _data no se hashea.
+    """
+    filtered_data = {}
+    
+    # Combinaciones seleccionadas como MultiIndex: se construyen una sola vez
+    # y sirven para todos los productos
+    selected = pd.MultiIndex.from_tuples(list(id_note_combinations), names=['ID', 'Note'])
+    
+    for product in products:
+        if product not in _data:
+            continue
             
+        df = _data[product]
+        
+        # Filtrar por combinaciones ID-Note (búsqueda por hash en una sola pasada)
+        mask = pd.MultiIndex.from_frame(df[['ID', 'Note']]).isin(selected)
+        
+        filtered_df = df[mask]
+        
+        if not filtered_df.empty:
+            filtered_data[product] = filtered_df
+    
+    return filtered_data
+
+
+@st.cache_data(show_spinner=False, max_entries=SELECTION_CACHE_ENTRIES)
+def _calc_stats(data_key, filter_key, _filtered_data):
+    """
+    Calcular estadísticas por producto y lámpara (Note).
+    
+    Cacheado según la huella del archivo (data_key) y las filas
+    seleccionadas de cada producto (filter_key); _filtered_data no se hashea.
+    """
+    stats = {}
+    
+    for product, df in _filtered_data.items():
+        product_stats = {}
+        
+        # Parámetros numéricos, en el orden original de columnas
+        numeric_cols = [col for col in df.select_dtypes(include=[np.number]).columns if col != 'No']
+        
+        # Agrupar por Note (lámpara) y agregar todos los parámetros en una sola pasada
+        grouped = df.groupby('Note', sort=False, observed=True)
+        sizes = grouped.size()
+        
+        # agg_arr[nota, parámetro, estadístico], en el orden de STATS_AGG; las
+        # notas siguen el mismo orden (de aparición) que sizes
+        agg_arr = np.empty((len(sizes), len(numeric_cols), len(STATS_AGG)))
+        if numeric_cols:
+            agg = grouped[numeric_cols].agg(list(STATS_AGG))
+            agg_arr = agg.to_numpy(dtype=np.float64).reshape(agg_arr.shape)
+        values = df[numeric_cols].to_numpy(dtype=np.float64)
+        
+        for (note, n), note_agg in zip(sizes.items(), agg_arr):
+            note_values = values[grouped.indices[note]]
+            
+            note_stats = {
+                'n': int(n),
+                'note': note
+            }
+            
+            for col_idx, (col, (mean, std, min_val, max_val, count)) in enumerate(zip(numeric_cols, note_agg.tolist())):
+                if count > 0:
+                    col_values = note_values[:, col_idx]
+                    note_stats[col] = {
+                        'mean': mean,
+                        'std': std,
+                        'min': min_val,
+                        'max': max_val,
+                        'values': col_values[~np.isnan(col_values)]
+                    }
+            
+            product_stats[note] = note_stats
+        
+        stats[product] = product_stats
+    
+    stats_key = hashlib.blake2b(repr((data_key, filter_key)).encode(), digest_size=16).hexdigest()
+    return NIRStats(stats, stats_key)
+
+
+class NIRAnalyzer:
+    """Clase para analizar datos NIR desde archivos XML"""
+    
+    def __init__(self):
+        self.data = {}
+        self.products = []
+        self.sensor_serial = None
+        self.data_key = None
+        
+    def parse_xml(self, uploaded_file):
+        """Parse XML file from NIR-Online software"""
+        try:
+            # Leer el contenido del archivo
+            self.parse_bytes(uploaded_file.read())
             return True
             
         except Exception as e:
             st.error(f"Error al parsear el archivo XML: {str(e)}")
             return False
     
+    def parse_bytes(self, content):
+        """Cargar los datos desde el contenido del XML (lanza excepción si falla)"""
+        # Huella del archivo, usada como clave de las cachés
+        self.data_key = hashlib.blake2b(content, digest_size=16).hexdigest()
+        
+        # Parse XML (la caché por archivo es la de load_analyzer)
+        data, products, sensor_serial = _parse_nir_bytes(content)
+        
+        self.data = data
+        self.products = list(products)
+        
+        # Guardar el número de serie del sensor
+        self.sensor_serial = sensor_serial
+    
     def get_id_note_combinations(self, products):
         """Obtener combinaciones únicas de ID y Note para productos seleccionados"""
-        combinations = set()
+        frames = [self.data[product][['ID', 'Note']] for product in products if product in self.data]
+        
+        if not frames:
+            return []
         
-        for product in products:
-            if product in self.data:
-                df = self.data[product]
-                for _, row in df.iterrows():
-                    id_val = row.get('ID', '')
-                    note_val = row.get('Note', '')
-                    if pd.notna(id_val) and pd.notna(note_val):
-                        combinations.add((id_val, note_val))
+        combinations = pd.concat(frames, ignore_index=True).dropna().drop_duplicates()
         
-        return sorted(list(combinations))
+        return sorted(map(tuple, combinations.to_numpy()))
+    
+    def get_ids_and_notes(self, products):
+        """Obtener IDs y Notes únicos para productos seleccionados"""
+        return _gather_axes(self.data_key, tuple(products), self.data)
     
     def filter_data(self, products, id_note_combinations):
         """Filtrar datos por productos y combinaciones ID-Note"""
-        filtered_data = {}
-        
-        for product in products:
-            if product not in self.data:
-                continue
-                
-            df = self.data[product].copy()
-            
-            # Filtrar por combinaciones ID-Note
-            mask = pd.Series([False] * len(df))
-            for id_val, note_val in id_note_combinations:
-                mask |= ((df['ID'] == id_val) & (df['Note'] == note_val))
-            
-            filtered_df = df[mask]
-            
-            if not filtered_df.empty:
-                filtered_data[product] = filtered_df
-        
-        return filtered_data
+        # Combinaciones ordenadas: la misma selección da la misma clave de caché
+        return _filter_data(self.data_key, tuple(products), tuple(sorted(id_note_combinations)), self.data)
     
     def calculate_statistics(self, filtered_data):
         """Calcular estadísticas por producto y lámpara (Note)"""
-        stats = {}
-        
-        for product, df in filtered_data.items():
-            product_stats = {}
-            
-            # Agrupar por Note (lámpara)
-            for note in df['Note'].unique():
-                note_df = df[df['Note'] == note]
-                
-                note_stats = {
-                    'n': len(note_df),
-                    'note': note
-                }
-                
-                # Calcular media y std para cada parámetro numérico
-                numeric_cols = note_df.select_dtypes(include=[np.number]).columns
-                
-                for col in numeric_cols:
-                    if col != 'No':
-                        values = note_df[col].dropna()
-                        if len(values) > 0:
-                            note_stats[col] = {
-                                'mean': values.mean(),
-                                'std': values.std(),
-                                'min': values.min(),
-                                'max': values.max(),
-                                'values': values.tolist()
-                            }
-                
-                product_stats[note] = note_stats
-            
-            stats[product] = product_stats
-        
-        return stats
+        # Los datos filtrados quedan determinados por las filas seleccionadas
+        filter_key = tuple((product, tuple(df.index)) for product, df in filtered_data.items())
+        return _calc_stats(self.data_key, filter_key, filtered_data)
+
+@st.cache_resource(show_spinner=False, max_entries=ANALYZER_CACHE_ENTRIES)
+def load_analyzer(content):
+    """
+    Analizador ya cargado para el contenido de un XML.
+    
+    Cacheado como recurso: los reruns reutilizan el mismo objeto y sus
+    DataFrames en memoria, sin volver a parsear ni copiar los datos. Solo
+    se guardan los últimos ANALYZER_CACHE_ENTRIES archivos.
+    """
+    analyzer = NIRAnalyzer()
+    analyzer.parse_bytes(content)
+    return analyzer
 
+
+@lru_cache(maxsize=1)
+def setup_plotly():
+    """
+    Importa Plotly y registra la plantilla corporativa.
+    
+    Se llama al crear la primera figura: la página inicial (sin archivo
+    cargado) no paga la importación de Plotly.
+    """
+    import plotly.graph_objects as go
+    import plotly.io as pio
+    
+    # Solo la plantilla corporativa (sin combinarla con plotly_white): cada
+    # figura la lleva incrustada y así el JSON no crece con estilos que no se usan
+    pio.templates['buchi'] = go.layout.Template(PLOTLY_TEMPLATE)
+    pio.templates.default = 'buchi'
+
+
+@lru_cache(maxsize=1)
+def plotlyjs_cdn_url():
+    """plotly.js de la misma versión que usa plotly.py (para el encabezado del reporte)"""
+    from plotly.offline import get_plotlyjs_version
+    return f"https://cdn.plot.ly/plotly-{get_plotlyjs_version()}.min.js"
+
+
+@lru_cache(maxsize=1)
 def load_buchi_css():
-    """Carga el CSS corporativo de BUCHI"""
+    """Carga el CSS corporativo de BUCHI (se lee una sola vez por proceso)"""
     try:
         with open('buchi_report_styles_simple.css', 'r', encoding='utf-8') as f:
             return f.read()
@@ -278,6 +577,20 @@ def load_buchi_css():
                 font-weight: 600 !important;
             }
             
+            /* Tablas de estadísticas del reporte: columna de lámpara destacada */
+            .stats-table th {
+                text-align: center;
+            }
+            
+            .stats-table th:first-child {
+                text-align: left;
+            }
+            
+            .stats-table td:first-child {
+                font-weight: bold;
+                background-color: #f8f9fa;
+            }
+            
             /* Expanders */
             .streamlit-expanderHeader {
                 background-color: #f8f9fa;
@@ -341,7 +654,7 @@ def generate_html_header():
         <meta charset="UTF-8">
         <meta name="viewport" content="width=device-width, initial-scale=1.0">
         <title>Reporte de Predicciones NIR - BUCHI</title>
-        <script src="https://cdn.plot.ly/plotly-latest.min.js"></script>
+        <script src="{plotlyjs_cdn_url()}"></script>
         <style>
             {load_buchi_css()}
         </style>
@@ -358,6 +671,12 @@ def generate_html_header():
     
     return html
     
+def _lamp_palette(n_lamps):
+    """Colores de las lámparas (paleta Plotly repetida cíclicamente)"""
+    from plotly.colors import qualitative
+    return list(islice(cycle(qualitative.Plotly), n_lamps))
+
+
 def create_comparison_plots(stats):
     """Crear gráficos comparativos entre lámparas para todos los parámetros"""
     
@@ -365,11 +684,7 @@ def create_comparison_plots(stats):
     products = list(stats.keys())
     
     # Obtener todas las lámparas
-    lamps = set()
-    for product_stats in stats.values():
-        lamps.update(product_stats.keys())
-    
-    lamps = sorted(list(lamps))
+    lamps = stats.all_lamps
     
     if len(lamps) < 2:
         st.warning("Se necesitan al menos 2 lámparas diferentes para comparar.")
@@ -428,40 +743,56 @@ def create_comparison_plots(stats):
         return None
     
     # Obtener todos los parámetros disponibles para el producto seleccionado
-    all_params = set()
-    for lamp in selected_lamps:
-        if lamp in stats[selected_product]:
-            all_params.update([k for k in stats[selected_product][lamp].keys() if k not in ['n', 'note']])
-    
-    all_params = sorted(list(all_params))
+    lamp_params = stats.lamp_params[selected_product]
+    all_params = sorted(set().union(*(lamp_params[lamp] for lamp in selected_lamps if lamp in lamp_params)))
     
     if not all_params:
         st.warning("No se encontraron parámetros para comparar.")
         return None
     
+    fig = _build_comparison_fig(stats.key, selected_product, tuple(selected_lamps), tuple(all_params), stats)
+    if fig is None:
+        st.warning("No hay datos suficientes para comparar entre las lámparas seleccionadas.")
+    return fig
+
+
+@st.cache_resource(show_spinner=False, max_entries=FIGURE_CACHE_ENTRIES)
+def _build_comparison_fig(stats_key, selected_product, selected_lamps, all_params, _stats):
+    """
+    Construir la figura de diferencias entre lámparas.
+    
+    Cacheada según la huella de las estadísticas y la selección, para no
+    reconstruir las trazas al tocar otros widgets; _stats no se hashea.
+    Devuelve None si ningún parámetro tiene diferencias que mostrar.
+    """
+    import plotly.graph_objects as go
+    from plotly.subplots import make_subplots
+    setup_plotly()
+    
+    stats = _stats
+    selected_lamps = list(selected_lamps)
+    all_params = list(all_params)
+    
     # Usar la primera lámpara como baseline
     baseline_lamp = selected_lamps[0]
     comparison_lamps = selected_lamps[1:]
     
-    # Calcular diferencias para cada lámpara comparada con el baseline
-    # differences[param][lamp] = valor de diferencia
-    differences = {param: {} for param in all_params}
+    # Medias por lámpara (filas) y parámetro (columnas); NaN si no hay datos
+    product_stats = stats[selected_product]
+    means_df = pd.DataFrame(
+        {lamp: {param: product_stats[lamp][param]['mean'] for param in all_params if param in product_stats[lamp]}
+         for lamp in selected_lamps},
+        index=all_params
+    ).T
     
-    for param in all_params:
-        if param in stats[selected_product][baseline_lamp]:
-            baseline_value = stats[selected_product][baseline_lamp][param]['mean']
-            
-            for lamp in comparison_lamps:
-                if lamp in stats[selected_product] and param in stats[selected_product][lamp]:
-                    lamp_value = stats[selected_product][lamp][param]['mean']
-                    diff = lamp_value - baseline_value
-                    differences[param][lamp] = diff
+    # Calcular diferencias para cada lámpara comparada con el baseline
+    # differences.loc[lamp, param] = valor de diferencia
+    differences = means_df.loc[comparison_lamps].sub(means_df.loc[baseline_lamp], axis=1)
     
     # Filtrar parámetros que tienen al menos un valor
-    params_with_data = [p for p in all_params if any(differences[p].values() if differences[p] else [])]
+    params_with_data = [p for p in all_params if (differences[p].notna() & (differences[p] != 0)).any()]
     
     if not params_with_data:
-        st.warning("No hay datos suficientes para comparar entre las lámparas seleccionadas.")
         return None
     
     # Calcular número de filas y columnas para subplots
@@ -485,70 +816,88 @@ def create_comparison_plots(stats):
     for idx, lamp in enumerate(comparison_lamps):
         lamp_colors[lamp] = color_palette[idx] if idx < len(color_palette) else '#95A5A6'
     
+    # Trazas acumuladas y añadidas al final con un único add_traces
+    traces, trace_rows, trace_cols = [], [], []
+    
+    # Entradas de leyenda (trazas vacías, una por lámpara). Las barras de cada
+    # subplot van en una sola traza, así que la leyenda solo identifica colores:
+    # pulsar una lámpara no ocultaría sus barras y se desactiva (itemclick)
+    for lamp in comparison_lamps:
+        traces.append(go.Bar(
+            name=lamp,
+            x=[None],
+            y=[None],
+            marker=dict(color=lamp_colors[lamp]),
+            showlegend=True,
+            legendgroup=lamp
+        ))
+        trace_rows.append(1)
+        trace_cols.append(1)
+    
+    # Límite del eje Y de cada subplot: máxima |diferencia| + 20% de margen
+    y_limits = np.nanmax(np.abs(differences[params_with_data].to_numpy(dtype=np.float64)), axis=0) * 1.2
+    
     for idx, param in enumerate(params_with_data):
         row = idx // n_cols + 1
         col = idx % n_cols + 1
         
         # Obtener valores de diferencia para este parámetro
-        lamps_list = list(differences[param].keys())
-        values = list(differences[param].values())
+        param_differences = differences[param].dropna()
+        lamps_list = param_differences.index.tolist()
+        values = param_differences.tolist()
         
         if not values:
             continue
         
-        # Crear barras para cada lámpara comparada
-        for lamp_idx, lamp in enumerate(lamps_list):
-            if lamp in differences[param]:
-                value = differences[param][lamp]
-                color = lamp_colors.get(lamp, '#95A5A6')
-                
-                fig.add_trace(
-                    go.Bar(
-                        name=lamp,
-                        x=[lamp],
-                        y=[value],
-                        marker=dict(color=color),
-                        text=[f"{value:+.3f}"],
-                        textposition='inside',
-                        textfont=dict(color='white', size=10),
-                        showlegend=(idx == 0),  # Solo mostrar leyenda en el primer gráfico
-                        legendgroup=lamp
-                    ),
-                    row=row, col=col
-                )
+        # Una sola traza de barras por subplot (una barra por lámpara)
+        traces.append(go.Bar(
+            x=lamps_list,
+            y=values,
+            marker=dict(color=[lamp_colors.get(lamp, '#95A5A6') for lamp in lamps_list]),
+            text=[f"{value:+.3f}" for value in values],
+            textposition='inside',
+            textfont=dict(color='white', size=10),
+            hovertemplate='%{x}: %{y:+.3f}<extra></extra>',
+            showlegend=False
+        ))
+        trace_rows.append(row)
+        trace_cols.append(col)
         
         # Configurar eje Y independiente para cada parámetro
-        # Calcular rango simétrico alrededor de cero
-        if values:
-            max_abs = max(abs(v) for v in values)
-            y_range = [-max_abs * 1.2, max_abs * 1.2]  # 20% de margen
-            
-            fig.update_yaxes(
-                title_text=f"Δ (%)",
-                row=row, 
-                col=col,
-                range=y_range,
-                zeroline=True,
-                zerolinewidth=2,
-                zerolinecolor='black'
-            )
+        # Rango simétrico alrededor de cero
+        y_range = [-y_limits[idx], y_limits[idx]]
+        
+        fig.update_yaxes(
+            title_text=f"Δ (%)",
+            row=row, 
+            col=col,
+            range=y_range,
+            zeroline=True,
+            zerolinewidth=2,
+            zerolinecolor='black'
+        )
         
         fig.update_xaxes(title_text="", row=row, col=col)
     
+    fig.add_traces(traces, rows=trace_rows, cols=trace_cols)
+    
     # Configurar layout
     fig.update_layout(
         height=300 * n_rows,
         title_text=f"<b>{selected_product}</b> - Diferencias respecto a {baseline_lamp}",
         showlegend=True,
+        uirevision='static',
         legend=dict(
             orientation="h",
             yanchor="bottom",
             y=-0.15,
             xanchor="center",
             x=0.5,
-            title=dict(text="Lámparas comparadas:")
+            title=dict(text="Lámparas comparadas:"),
+            itemclick=False,
+            itemdoubleclick=False
         ),
-        barmode='group'
+        barmode='overlay'
     )
     
     return fig
@@ -557,33 +906,35 @@ def create_comparison_plots(stats):
 def create_detailed_comparison(stats, param='H'):
     """Crear gráfico de comparación detallada por producto"""
     
-    products = list(stats.keys())
-    lamps = set()
-    for product_stats in stats.values():
-        lamps.update(product_stats.keys())
-    lamps = sorted(list(lamps))
-    
-    # Filtrar productos que tienen datos para el parámetro seleccionado
-    products_with_data = []
-    for product in products:
-        has_data = False
-        for lamp in lamps:
-            if lamp in stats[product] and param in stats[product][lamp]:
-                has_data = True
-                break
-        if has_data:
-            products_with_data.append(product)
+    # Productos que tienen datos para el parámetro seleccionado
+    products_with_data = stats.param_to_products.get(param, [])
     
     if not products_with_data:
         st.warning(f"No hay datos disponibles para el parámetro {param}")
         return None
     
+    return _build_detailed_fig(stats.key, param, stats)
+
+
+@st.cache_resource(show_spinner=False, max_entries=FIGURE_CACHE_ENTRIES)
+def _build_detailed_fig(stats_key, param, _stats):
+    """Construir la figura de comparación detallada (cacheada; _stats no se hashea)"""
+    import plotly.graph_objects as go
+    from plotly.subplots import make_subplots
+    setup_plotly()
+    
+    stats = _stats
+    lamps = stats.all_lamps
+    products_with_data = stats.param_to_products[param]
+    
+    # Filas del parámetro, ordenadas por producto y lámpara (all_lamps está
+    # ordenada alfabéticamente)
+    product_pos = {product: idx for idx, product in enumerate(products_with_data)}
+    sub = stats.stats_df[stats.stats_df['param'] == param]
+    sub = sub.assign(col=sub['product'].map(product_pos) + 1).sort_values(['col', 'lamp'], kind='stable')
+    
     # Calcular valor máximo para ajustar escala Y
-    max_val = 0
-    for product in products_with_data:
-        for lamp in lamps:
-            if lamp in stats[product] and param in stats[product][lamp]:
-                max_val = max(max_val, stats[product][lamp][param]['mean'])
+    max_val = max(0, sub['mean'].max())
     
     # Número de subplots
     n_products = len(products_with_data)
@@ -593,27 +944,24 @@ def create_detailed_comparison(stats, param='H'):
         subplot_titles=[f"{prod} - {param}" for prod in products_with_data]
     )
     
-    colors = px.colors.qualitative.Plotly
+    lamp_colors = dict(zip(lamps, _lamp_palette(len(lamps))))
+    
+    # Una barra por producto y lámpara; la leyenda sale del primer subplot
+    traces = [
+        go.Bar(
+            name=lamp,
+            x=[lamp],
+            y=[mean_val],
+            marker=dict(color=lamp_colors[lamp]),
+            showlegend=(col == 1),
+            text=[f"{mean_val:.2f}"],
+            textposition='inside'
+        )
+        for col, lamp, mean_val in zip(sub['col'].tolist(), sub['lamp'].tolist(), sub['mean'].tolist())
+    ]
+    trace_cols = sub['col'].tolist()
     
-    for col_idx, product in enumerate(products_with_data):
-        for lamp_idx, lamp in enumerate(lamps):
-            if lamp in stats[product]:
-                if param in stats[product][lamp]:
-                    mean_val = stats[product][lamp][param]['mean']
-                    
-                    fig.add_trace(
-                        go.Bar(
-                            name=lamp,
-                            x=[lamp],
-                            y=[mean_val],
-                            marker=dict(color=colors[lamp_idx % len(colors)]),
-                            showlegend=(col_idx == 0),
-                            text=[f"{mean_val:.2f}"],
-                            textposition='inside'
-                        ),
-                        row=1, col=col_idx+1
-                    )
-        
+    for col_idx in range(len(products_with_data)):
         fig.update_yaxes(
             title_text=f"{param} (%)", 
             row=1, 
@@ -621,42 +969,87 @@ def create_detailed_comparison(stats, param='H'):
             range=[0, max_val * 1.15]
         )
     
+    fig.add_traces(traces, rows=[1] * len(traces), cols=trace_cols)
+    
     fig.update_layout(
         height=400,
         title_text=f"Comparación Detallada: Media y Variabilidad por Lámpara - {param}",
         showlegend=True,
+        uirevision='static',
         barmode='group'
     )
     
     return fig
 
+# Parámetros por producto ya calculados: {(data_key, producto): [parámetros]}
+_PARAMS_CACHE = {}
+
+
+def get_params(analyzer, product):
+    """
+    Parámetros de un producto en el orden original de columnas del XML.
+    
+    Memoizado por huella del archivo y producto; la lista devuelta es
+    compartida y no debe modificarse.
+    """
+    cache_key = (analyzer.data_key, product)
+    params = _PARAMS_CACHE.get(cache_key)
+    if params is None:
+        cols = analyzer.data[product].columns
+        # Excluir metadatos y la columna con el nombre del producto
+        excluded = META_COLUMNS | {cols[1]} if len(cols) > 1 else META_COLUMNS
+        params = [col for col in cols if col not in excluded]
+        if analyzer.data_key is not None:
+            _PARAMS_CACHE[cache_key] = params
+    return params
+
+
 def get_params_in_original_order(analyzer, products):
     """Obtener parámetros en el orden original del archivo XML"""
     params_order = []
     
-    # Usar el primer producto para obtener el orden de columnas
     for product in products:
         if product in analyzer.data:
-            df = analyzer.data[product]
-            # Excluir columnas no numéricas y metadatos
-            excluded_cols = ['No', 'ID', 'Note', 'Product', 'Method', 'Unit', 'Begin', 'End', 'Length']
-            # También excluir las columnas que son nombres de productos
-            if len(df.columns) > 1:
-                excluded_cols.append(df.columns[1])
-            
-            params = [col for col in df.columns if col not in excluded_cols]
+            params = get_params(analyzer, product)
             params_order.extend([p for p in params if p not in params_order])
     
     return params_order
 
 
-def create_box_plots(stats, analyzer):
-    """Crear box plots para todos los productos y parámetros"""
-    
-    products = list(stats.keys())
+def _box_summary(values):
+    """
+    Estadísticos de una caja calculados igual que en plotly.js: cuartiles por
+    interpolación (posición p·n - 0.5), bigotes en los valores extremos dentro
+    de 1.5 IQR y desviación típica poblacional. Las muestras fuera de los
+    bigotes se devuelven como outliers.
+    """
+    values = np.sort(values)
+    n = len(values)
+    
+    pos = np.clip(np.array([0.25, 0.5, 0.75]) * n - 0.5, 0, n - 1)
+    frac = pos % 1
+    below, above = np.floor(pos).astype(int), np.ceil(pos).astype(int)
+    q1, median, q3 = frac * values[above] + (1 - frac) * values[below]
+    
+    low = values[min(np.searchsorted(values, 2.5 * q1 - 1.5 * q3, side='left'), n - 1)]
+    high = values[max(np.searchsorted(values, 2.5 * q3 - 1.5 * q1, side='right') - 1, 0)]
+    lowerfence = min(q1, low)
+    upperfence = max(q3, high)
+    
+    return dict(
+        q1=[q1], median=[median], q3=[q3],
+        lowerfence=[lowerfence], upperfence=[upperfence],
+        mean=[values.mean()], sd=[values.std()],
+        y=[values[(values < lowerfence) | (values > upperfence)]]
+    )
+
+
+def create_box_plots(stats, params):
+    """
+    Crear box plots para todos los productos y parámetros.
     
-    # Obtener parámetros en orden original
-    params = get_params_in_original_order(analyzer, products)
+    params: parámetros en orden original (get_params_in_original_order)
+    """
     
     # Permitir selección de parámetros
     selected_params = st.multiselect(
@@ -669,79 +1062,38 @@ def create_box_plots(stats, analyzer):
     if not selected_params:
         return None
     
-    colors = px.colors.qualitative.Plotly
-    lamps = set()
-    for product_stats in stats.values():
-        lamps.update(product_stats.keys())
-    lamps = sorted(list(lamps))
-    
-    # Para cada parámetro, verificar qué productos tienen datos
-    params_products_data = {}
-    for param in selected_params:
-        products_with_data = []
-        for product in products:
-            has_data = False
-            for lamp in lamps:
-                if lamp in stats[product] and param in stats[product][lamp]:
-                    has_data = True
-                    break
-            if has_data:
-                products_with_data.append(product)
-        
-        if products_with_data:
-            params_products_data[param] = products_with_data
-    
-    if not params_products_data:
+    # Verificar que algún parámetro tenga datos en algún producto
+    if not any(stats.param_to_products.get(param) for param in selected_params):
         st.warning("No hay datos disponibles para los parámetros seleccionados")
         return None
     
+    return _build_box_fig(stats.key, tuple(selected_params), stats)
+
+
+@st.cache_resource(show_spinner=False, max_entries=FIGURE_CACHE_ENTRIES)
+def _build_box_fig(stats_key, selected_params, _stats):
+    """Construir la figura de box plots (cacheada; _stats no se hashea)"""
+    import plotly.graph_objects as go
+    from plotly.subplots import make_subplots
+    setup_plotly()
+    
+    stats = _stats
+    lamps = stats.all_lamps
+    lamp_colors = _lamp_palette(len(lamps))
+    
+    # Para cada parámetro, los productos que tienen datos
+    params_products_data = {
+        param: stats.param_to_products[param]
+        for param in selected_params
+        if stats.param_to_products.get(param)
+    }
+    
     # Calcular estructura de subplots
     total_subplots = sum(len(prods) for prods in params_products_data.values())
     n_params = len(params_products_data)
     max_products = max(len(prods) for prods in params_products_data.values())
     
-    fig = make_subplots(
-        rows=n_params, 
-        cols=max_products,
-        subplot_titles=[],  # Los añadiremos manualmente
-        vertical_spacing=0.1,
-        horizontal_spacing=0.05
-    )
-    
-    row_idx = 0
-    for param in selected_params:
-        if param not in params_products_data:
-            continue
-            
-        row_idx += 1
-        products_with_data = params_products_data[param]
-        
-        for col_idx, product in enumerate(products_with_data):
-            # Añadir título manualmente
-            fig.layout.annotations[0 if row_idx == 1 and col_idx == 0 else len(fig.layout.annotations)].update(
-                text=f"{product}"
-            ) if len(fig.layout.annotations) > 0 else None
-            
-            for lamp_idx, lamp in enumerate(lamps):
-                if lamp in stats[product] and param in stats[product][lamp]:
-                    values = stats[product][lamp][param]['values']
-                    
-                    fig.add_trace(
-                        go.Box(
-                            name=lamp,
-                            y=values,
-                            marker=dict(color=colors[lamp_idx % len(colors)]),
-                            showlegend=(row_idx == 1 and col_idx == 0),
-                            boxmean='sd'
-                        ),
-                        row=row_idx, col=col_idx+1
-                    )
-            
-            # Actualizar etiquetas
-            if col_idx == 0:
-                fig.update_yaxes(title_text=f"{param} (%)", row=row_idx, col=col_idx+1)
-    
-    # Añadir títulos de subplot correctamente
+    # Títulos de subplot
     titles = []
     for param in selected_params:
         if param in params_products_data:
@@ -756,7 +1108,9 @@ def create_box_plots(stats, analyzer):
         horizontal_spacing=0.05
     )
     
-    # Recrear trazas con estructura correcta
+    # Trazas acumuladas y añadidas al final con un único add_traces
+    traces, trace_rows, trace_cols = [], [], []
+    
     row_idx = 0
     for param in selected_params:
         if param not in params_products_data:
@@ -770,24 +1124,33 @@ def create_box_plots(stats, analyzer):
                 if lamp in stats[product] and param in stats[product][lamp]:
                     values = stats[product][lamp][param]['values']
                     
-                    fig.add_trace(
-                        go.Box(
-                            name=lamp,
-                            y=values,
-                            marker=dict(color=colors[lamp_idx % len(colors)]),
-                            showlegend=(row_idx == 1 and col_idx == 0),
-                            boxmean='sd'
-                        ),
-                        row=row_idx, col=col_idx+1
-                    )
+                    if len(values) >= BOX_PRECOMPUTE_MIN_POINTS:
+                        # Muestra grande: se envían los estadísticos y los outliers
+                        # en lugar de todos los valores
+                        box_data = dict(x=[lamp], boxpoints='outliers', **_box_summary(values))
+                    else:
+                        box_data = dict(y=values)
+                    
+                    traces.append(go.Box(
+                        name=lamp,
+                        **box_data,
+                        marker=dict(color=lamp_colors[lamp_idx]),
+                        showlegend=(row_idx == 1 and col_idx == 0),
+                        boxmean='sd'
+                    ))
+                    trace_rows.append(row_idx)
+                    trace_cols.append(col_idx + 1)
             
             if col_idx == 0:
                 fig.update_yaxes(title_text=f"{param} (%)", row=row_idx, col=col_idx+1)
     
+    fig.add_traces(traces, rows=trace_rows, cols=trace_cols)
+    
     fig.update_layout(
         height=300 * n_params,
         title_text="Comparación de Predicciones por Lámpara",
-        showlegend=True
+        showlegend=True,
+        uirevision='static'
     )
     
     return fig
@@ -796,29 +1159,35 @@ def create_box_plots(stats, analyzer):
 def create_scatter_plots(stats):
     """Crear scatter plots H vs PB"""
     
-    products = list(stats.keys())
-    lamps = set()
-    for product_stats in stats.values():
-        lamps.update(product_stats.keys())
-    lamps = sorted(list(lamps))
-    
     # Buscar parámetros H y PB (o similares)
     param_h = None
     param_pb = None
     
-    for product_stats in stats.values():
-        for lamp_stats in product_stats.values():
-            for param in lamp_stats.keys():
-                if param not in ['n', 'note']:
-                    if 'H' in param.upper() and param_h is None:
-                        param_h = param
-                    if 'PB' in param.upper() or 'PROTEIN' in param.upper():
-                        param_pb = param
+    for lamp_params in stats.lamp_params.values():
+        for params in lamp_params.values():
+            for param in params:
+                if 'H' in param.upper() and param_h is None:
+                    param_h = param
+                if 'PB' in param.upper() or 'PROTEIN' in param.upper():
+                    param_pb = param
     
     if param_h is None or param_pb is None:
         st.warning("No se encontraron parámetros de Humedad (H) y Proteína (PB)")
         return None
     
+    return _build_scatter_fig(stats.key, param_h, param_pb, stats)
+
+
+@st.cache_resource(show_spinner=False, max_entries=FIGURE_CACHE_ENTRIES)
+def _build_scatter_fig(stats_key, param_h, param_pb, _stats):
+    """Construir la figura H vs PB (cacheada; _stats no se hashea)"""
+    import plotly.graph_objects as go
+    from plotly.subplots import make_subplots
+    setup_plotly()
+    
+    stats = _stats
+    products = list(stats.keys())
+    lamps = stats.all_lamps
     n_products = len(products)
     
     fig = make_subplots(
@@ -826,47 +1195,109 @@ def create_scatter_plots(stats):
         subplot_titles=[f"{prod} - {param_h} vs {param_pb}" for prod in products]
     )
     
-    colors = px.colors.qualitative.Plotly
+    lamp_colors = _lamp_palette(len(lamps))
+    
+    # Entradas de leyenda (trazas vacías, una por lámpara); todas las
+    # trazas se añaden al final con un único add_traces. Los puntos de cada
+    # subplot van en una sola traza, así que la leyenda solo identifica colores:
+    # pulsar una lámpara no ocultaría sus puntos y se desactiva (itemclick)
+    traces = [
+        go.Scatter(
+            name=lamp,
+            x=[None],
+            y=[None],
+            mode='markers',
+            marker=dict(color=lamp_colors[lamp_idx], size=10),
+            showlegend=True,
+            legendgroup=lamp
+        )
+        for lamp_idx, lamp in enumerate(lamps)
+    ]
+    trace_cols = [1] * len(traces)
     
     for col_idx, product in enumerate(products):
+        # Una sola traza por subplot; el color y el nombre de cada punto
+        # identifican la lámpara. x/y se pasan como ndarray float64 para
+        # que Plotly los copie sin recorrerlos elemento a elemento
+        xs, ys, cs, names = [], [], [], []
         for lamp_idx, lamp in enumerate(lamps):
             if lamp in stats[product]:
                 if param_h in stats[product][lamp] and param_pb in stats[product][lamp]:
                     h_values = stats[product][lamp][param_h]['values']
                     pb_values = stats[product][lamp][param_pb]['values']
                     
-                    fig.add_trace(
-                        go.Scatter(
-                            name=lamp,
-                            x=h_values,
-                            y=pb_values,
-                            mode='markers',
-                            marker=dict(
-                                color=colors[lamp_idx % len(colors)],
-                                size=10,
-                                line=dict(width=1, color='white')
-                            ),
-                            showlegend=(col_idx == 0)
-                        ),
-                        row=1, col=col_idx+1
-                    )
+                    # Plotly empareja x/y por posición hasta la longitud menor
+                    n = min(len(h_values), len(pb_values))
+                    xs.append(h_values[:n])
+                    ys.append(pb_values[:n])
+                    cs.extend([lamp_colors[lamp_idx]] * n)
+                    names.extend([lamp] * n)
+        
+        if xs:
+            x = np.concatenate(xs)
+            y = np.concatenate(ys)
+            
+            # Nubes muy grandes: submuestreo uniforme (mantiene la proporción
+            # de puntos de cada lámpara)
+            if len(x) > SCATTER_MAX_POINTS:
+                keep = np.linspace(0, len(x) - 1, SCATTER_MAX_POINTS).astype(np.intp)
+                x, y = x[keep], y[keep]
+                cs = np.asarray(cs)[keep]
+                names = np.asarray(names)[keep]
+            
+            scatter = go.Scattergl if len(x) > SCATTERGL_MIN_POINTS else go.Scatter
+            traces.append(scatter(
+                x=x,
+                y=y,
+                mode='markers',
+                marker=dict(
+                    color=cs,
+                    size=10,
+                    line=dict(width=1, color='white')
+                ),
+                customdata=names,
+                hovertemplate='%{customdata}<br>%{x}, %{y}<extra></extra>',
+                showlegend=False
+            ))
+            trace_cols.append(col_idx + 1)
         
         fig.update_xaxes(title_text=f"{param_h} (%)", row=1, col=col_idx+1)
         if col_idx == 0:
             fig.update_yaxes(title_text=f"{param_pb} (%)", row=1, col=col_idx+1)
     
+    fig.add_traces(traces, rows=[1] * len(traces), cols=trace_cols)
+    
     fig.update_layout(
         height=400,
         title_text=f"{param_h} vs {param_pb}",
-        showlegend=True
+        showlegend=True,
+        legend=dict(itemclick=False, itemdoubleclick=False),
+        uirevision='static'
     )
     
     return fig
 
+def _classify(baseline, compared):
+    """
+    Diferencias entre dos vectores de medias y su tramo de evaluación.
+    
+    Returns:
+        (abs_diff, percent_diff, eval_idx): eval_idx indexa _EVAL_TABLE;
+        percent_diff es 0 cuando la media baseline es 0.
+    """
+    abs_diff = compared - baseline
+    percent_diff = np.divide(abs_diff, baseline, out=np.zeros_like(abs_diff), where=baseline != 0) * 100
+    eval_idx = np.searchsorted(_EVAL_BOUNDS, np.abs(percent_diff), side='right')
+    return abs_diff, percent_diff, eval_idx
+
+
 def calculate_lamp_differences(stats, analyzer):
     """
     Calcula diferencias entre lámparas para cada producto de forma estructurada.
     
+    En cada comparación, 'param_order' da los índices de 'differences' (en
+    su orden de inserción) de mayor a menor diferencia absoluta.
+    
     Returns:
         dict: {
             'Producto A': {
@@ -881,10 +1312,12 @@ def calculate_lamp_differences(stats, analyzer):
                                 'baseline_mean': 10.5,
                                 'compared_mean': 10.7,
                                 'absolute_diff': 0.2,
-                                'percent_diff': 1.9
+                                'percent_diff': 1.9,
+                                'eval_idx': 0
                             },
                             'PB': {...}
-                        }
+                        },
+                        'param_order': [1, 0]
                     }
                 ]
             }
@@ -904,46 +1337,45 @@ def calculate_lamp_differences(stats, analyzer):
         
         # Obtener parámetros en orden original
         if product in analyzer.data:
-            df = analyzer.data[product]
-            excluded_cols = ['No', 'ID', 'Note', 'Product', 'Method', 'Unit', 'Begin', 'End', 'Length']
-            if len(df.columns) > 1:
-                excluded_cols.append(df.columns[1])
-            params = [col for col in df.columns if col not in excluded_cols]
+            params = get_params(analyzer, product)
         else:
-            params = set()
-            for lamp_stats in product_stats.values():
-                params.update([k for k in lamp_stats.keys() if k not in ['n', 'note']])
-            params = sorted(list(params))
+            params = stats.product_params[product]
         
         # Estructura de comparaciones
         comparisons = []
         
+        baseline_stats = product_stats[baseline_lamp]
+        
         for comp_lamp in comparison_lamps:
-            comparison = {
-                'lamp': comp_lamp,
-                'n_baseline': product_stats[baseline_lamp]['n'],
-                'n_compared': product_stats[comp_lamp]['n'],
-                'differences': {}
-            }
+            comp_stats = product_stats[comp_lamp]
             
-            for param in params:
-                if (param in product_stats[baseline_lamp] and 
-                    param in product_stats[comp_lamp]):
-                    
-                    baseline_mean = product_stats[baseline_lamp][param]['mean']
-                    compared_mean = product_stats[comp_lamp][param]['mean']
-                    
-                    abs_diff = compared_mean - baseline_mean
-                    percent_diff = (abs_diff / baseline_mean * 100) if baseline_mean != 0 else 0
-                    
-                    comparison['differences'][param] = {
-                        'baseline_mean': baseline_mean,
-                        'compared_mean': compared_mean,
-                        'absolute_diff': abs_diff,
-                        'percent_diff': percent_diff
-                    }
+            # Parámetros con datos en ambas lámparas, en orden original
+            common = [p for p in params if p in baseline_stats and p in comp_stats]
             
-            comparisons.append(comparison)
+            # Medias como vectores; diferencias y evaluación en una sola pasada
+            baseline_vec = np.fromiter((baseline_stats[p]['mean'] for p in common), dtype=np.float64, count=len(common))
+            compared_vec = np.fromiter((comp_stats[p]['mean'] for p in common), dtype=np.float64, count=len(common))
+            abs_diff, percent_diff, eval_idx = _classify(baseline_vec, compared_vec)
+            
+            comparisons.append({
+                'lamp': comp_lamp,
+                'n_baseline': baseline_stats['n'],
+                'n_compared': comp_stats['n'],
+                'param_order': np.argsort(-np.abs(abs_diff), kind='stable').tolist(),
+                'differences': {
+                    param: {
+                        'baseline_mean': b,
+                        'compared_mean': c,
+                        'absolute_diff': a,
+                        'percent_diff': pc,
+                        'eval_idx': ev
+                    }
+                    for param, b, c, a, pc, ev in zip(
+                        common, baseline_vec.tolist(), compared_vec.tolist(),
+                        abs_diff.tolist(), percent_diff.tolist(), eval_idx.tolist()
+                    )
+                }
+            })
         
         differences_by_product[product] = {
             'baseline_lamp': baseline_lamp,
@@ -952,6 +1384,23 @@ def calculate_lamp_differences(stats, analyzer):
     
     return differences_by_product
 
+# Fila de la tabla de diferencias (se rellena con str.format_map)
+_ROW_TMPL = """
+                    <tr style="background-color: {row_bg};">
+                        <td style="font-weight: bold;">{param}</td>
+                        <td style="text-align: center;">{baseline_val:.3f}</td>
+                        <td style="text-align: center;">{compared_val:.3f}</td>
+                        <td style="text-align: center; font-weight: bold;">{direction} {abs_abs_diff:.3f}</td>
+                        <td style="text-align: center; font-weight: bold; color: {eval_color};">
+                            {abs_diff:+.3f} ({percent_diff:+.2f}%)
+                        </td>
+                        <td style="text-align: center; color: {eval_color}; font-weight: bold;">
+                            {evaluation}
+                        </td>
+                    </tr>
+                """
+
+
 def generate_differences_section(differences_data):
     """
     Genera HTML para la sección de diferencias por producto.
@@ -963,7 +1412,7 @@ def generate_differences_section(differences_data):
         str: HTML con visualización de diferencias
     """
     
-    html = """
+    parts = ["""
     <div class="info-box" id="differences-by-product">
         <h2>📊 Diferencias por Producto</h2>
         <p style='color: #6c757d; font-size: 0.95em; margin-bottom: 25px;'>
@@ -971,20 +1420,20 @@ def generate_differences_section(differences_data):
             Se muestra la diferencia absoluta y porcentual de cada parámetro respecto 
             a la lámpara baseline (primera lámpara seleccionada).</em>
         </p>
-    """
+    """]
     
     for product, product_data in differences_data.items():
         baseline_lamp = product_data['baseline_lamp']
         comparisons = product_data['comparisons']
         
-        html += f"""
+        parts.append(f"""
         <div style="margin-bottom: 40px; padding: 20px; background-color: #f8f9fa; border-radius: 8px; border-left: 4px solid #64B445;">
             <h3 style="margin-top: 0; color: #093A34;">🔬 {product}</h3>
             <p style="color: #6c757d; font-size: 0.9em; margin-bottom: 20px;">
                 <strong>Lámpara Baseline:</strong> {baseline_lamp} 
                 (N = {comparisons[0]['n_baseline'] if comparisons else 'N/A'})
             </p>
-        """
+        """)
         
         for comparison in comparisons:
             comp_lamp = comparison['lamp']
@@ -992,7 +1441,7 @@ def generate_differences_section(differences_data):
             differences = comparison['differences']
             
             # Crear tabla de diferencias
-            html += f"""
+            parts.append(f"""
             <details open style="margin-bottom: 20px; border: 1px solid #dee2e6; border-radius: 5px; background-color: white;">
                 <summary style="cursor: pointer; padding: 15px; background-color: #e9ecef; border-radius: 5px; user-select: none; font-weight: bold;">
                     📍 {comp_lamp} vs {baseline_lamp} (N = {n_compared})
@@ -1011,63 +1460,41 @@ def generate_differences_section(differences_data):
                             </tr>
                         </thead>
                         <tbody>
-            """
+            """)
             
-            # Ordenar parámetros por diferencia absoluta (mayor a menor)
-            sorted_params = sorted(
-                differences.items(), 
-                key=lambda x: abs(x[1]['absolute_diff']), 
-                reverse=True
-            )
+            # Parámetros por diferencia absoluta (mayor a menor), según el
+            # orden precalculado en calculate_lamp_differences
+            params = list(differences)
             
-            for param, diff_data in sorted_params:
+            row_format = _ROW_TMPL.format_map
+            for i in comparison['param_order']:
+                param = params[i]
+                diff_data = differences[param]
                 baseline_val = diff_data['baseline_mean']
                 compared_val = diff_data['compared_mean']
                 abs_diff = diff_data['absolute_diff']
                 percent_diff = diff_data['percent_diff']
                 
-                # Clasificar magnitud de diferencia
-                abs_percent = abs(percent_diff)
-                if abs_percent < 2.0:
-                    evaluation = '🟢 Excelente'
-                    eval_color = '#4caf50'
-                elif abs_percent < 5.0:
-                    evaluation = '🟡 Aceptable'
-                    eval_color = '#ffc107'
-                elif abs_percent < 10.0:
-                    evaluation = '🟠 Revisar'
-                    eval_color = '#ff9800'
-                else:
-                    evaluation = '🔴 Significativo'
-                    eval_color = '#f44336'
-                
-                # Color de fondo para diferencia
-                if abs_percent < 2.0:
-                    row_bg = '#e8f5e9'
-                elif abs_percent < 5.0:
-                    row_bg = '#fff3e0'
-                else:
-                    row_bg = '#ffebee'
+                # Evaluación, color y fondo según el tramo calculado en _classify
+                evaluation, eval_color, row_bg = _EVAL_TABLE[diff_data['eval_idx']]
                 
                 # Símbolo de dirección
                 direction = '↑' if abs_diff > 0 else '↓' if abs_diff < 0 else '='
                 
-                html += f"""
-                    <tr style="background-color: {row_bg};">
-                        <td style="font-weight: bold;">{param}</td>
-                        <td style="text-align: center;">{baseline_val:.3f}</td>
-                        <td style="text-align: center;">{compared_val:.3f}</td>
-                        <td style="text-align: center; font-weight: bold;">{direction} {abs(abs_diff):.3f}</td>
-                        <td style="text-align: center; font-weight: bold; color: {eval_color};">
-                            {abs_diff:+.3f} ({percent_diff:+.2f}%)
-                        </td>
-                        <td style="text-align: center; color: {eval_color}; font-weight: bold;">
-                            {evaluation}
-                        </td>
-                    </tr>
-                """
-            
-            html += """
+                parts.append(row_format({
+                    'row_bg': row_bg,
+                    'param': param,
+                    'baseline_val': baseline_val,
+                    'compared_val': compared_val,
+                    'direction': direction,
+                    'abs_abs_diff': abs(abs_diff),
+                    'eval_color': eval_color,
+                    'abs_diff': abs_diff,
+                    'percent_diff': percent_diff,
+                    'evaluation': evaluation
+                }))
+            
+            parts.append("""
                         </tbody>
                     </table>
                     
@@ -1082,29 +1509,53 @@ def generate_differences_section(differences_data):
                     </div>
                 </div>
             </details>
-            """
+            """)
         
-        html += """
+        parts.append("""
         </div>
-        """
+        """)
     
-    html += """
+    parts.append("""
     </div>
+    """)
+    
+    return "".join(parts)
+
+@st.cache_data(show_spinner=False, max_entries=CHART_HTML_CACHE_ENTRIES)
+def _chart_html(stats_key, param, _stats):
     """
+    HTML del gráfico de comparación detallada de un parámetro (None si no
+    hay datos).
     
-    return html
+    Cacheado según la huella de las estadísticas; _stats no se hashea.
+    """
+    fig = create_detailed_comparison(_stats, param)
+    if not fig:
+        return None
+    return fig.to_html(
+        include_plotlyjs=False,
+        full_html=False,
+        div_id=f"graph_{param.replace(' ', '_')}"
+    )
+
 
 def generate_html_report(stats, analyzer, filename):
     """
     Generar reporte HTML completo con estilo corporativo BUCHI.
     """
+    buf = io.StringIO()
+    buf.writelines(_iter_html_report(stats, analyzer, filename))
+    return buf.getvalue()
+
+
+def _iter_html_report(stats, analyzer, filename):
+    """
+    Generar el reporte HTML por fragmentos, sin acumular listas intermedias.
+    """
     
     # Obtener información general
     products = list(stats.keys())
-    all_lamps = set()
-    for product_stats in stats.values():
-        all_lamps.update(product_stats.keys())
-    all_lamps = sorted(list(all_lamps))
+    all_lamps = stats.all_lamps
     
     sensor_serial = analyzer.sensor_serial if analyzer.sensor_serial else "N/A"
     timestamp = datetime.now().strftime('%d/%m/%Y %H:%M:%S')
@@ -1112,12 +1563,12 @@ def generate_html_report(stats, analyzer, filename):
     # ============================================
     # HEADER CON SIDEBAR
     # ============================================
-    html = generate_html_header()
+    yield generate_html_header()
     
     # ============================================
     # TÍTULO PRINCIPAL
     # ============================================
-    html += f"""
+    yield f"""
         <h1>Reporte de Predicciones NIR</h1>
         
         <div class="info-box" id="info-general">
@@ -1157,7 +1608,7 @@ def generate_html_report(stats, analyzer, filename):
     # ============================================
     # SECCIÓN 1: ESTADÍSTICAS POR PRODUCTO
     # ============================================
-    html += """
+    yield """
         <div class="info-box" id="statistics">
             <h2>Estadísticas por Producto y Lámpara</h2>
             <p style='color: #6c757d; font-size: 0.95em; margin-bottom: 25px;'>
@@ -1169,69 +1620,41 @@ def generate_html_report(stats, analyzer, filename):
     for product in products:
         # Obtener parámetros en orden original
         if product in analyzer.data:
-            df = analyzer.data[product]
-            excluded_cols = ['No', 'ID', 'Note', 'Product', 'Method', 'Unit', 'Begin', 'End', 'Length']
-            if len(df.columns) > 1:
-                excluded_cols.append(df.columns[1])
-            params = [col for col in df.columns if col not in excluded_cols]
+            params = get_params(analyzer, product)
         else:
-            params = set()
-            for lamp_stats in stats[product].values():
-                params.update([k for k in lamp_stats.keys() if k not in ['n', 'note']])
-            params = sorted(list(params))
+            params = stats.product_params[product]
+        
+        # Tabla lámpara × parámetro con "media ± SD"; sin datos -> "-"
+        table = pd.DataFrame(
+            [
+                [lamp, lamp_stats['n']] + [
+                    f"{lamp_stats[param]['mean']:.3f} ± {lamp_stats[param]['std']:.3f}"
+                    if param in lamp_stats else None
+                    for param in params
+                ]
+                for lamp, lamp_stats in stats[product].items()
+            ],
+            columns=['Lámpara', 'N'] + [
+                f'{param}<br/><span style="font-weight: normal; font-size: 0.85em;">(Media ± SD)</span>'
+                for param in params
+            ]
+        )
         
-        html += f"""
+        yield f"""
             <h3>{product}</h3>
             <div style="overflow-x: auto;">
-                <table>
-                    <thead>
-                        <tr>
-                            <th style="text-align: left;">Lámpara</th>
-                            <th>N</th>
-        """
-        
-        for param in params:
-            html += f'<th>{param}<br/><span style="font-weight: normal; font-size: 0.85em;">(Media ± SD)</span></th>'
-        
-        html += """
-                        </tr>
-                    </thead>
-                    <tbody>
-        """
-        
-        for lamp, lamp_stats in stats[product].items():
-            html += f"""
-                        <tr>
-                            <td style="font-weight: bold; background-color: #f8f9fa;">{lamp}</td>
-                            <td>{lamp_stats['n']}</td>
-            """
-            
-            for param in params:
-                if param in lamp_stats:
-                    mean = lamp_stats[param]['mean']
-                    std = lamp_stats[param]['std']
-                    html += f'<td>{mean:.3f} ± {std:.3f}</td>'
-                else:
-                    html += '<td>-</td>'
-            
-            html += """
-                        </tr>
-            """
-        
-        html += """
-                    </tbody>
-                </table>
+                {table.to_html(index=False, escape=False, na_rep='-', border=0, classes='stats-table')}
             </div>
         """
     
-    html += """
+    yield """
         </div>
     """
     
     # ============================================
     # SECCIÓN 2: GRÁFICOS COMPARATIVOS
     # ============================================
-    html += """
+    yield """
         <div class="info-box" id="comparison-charts">
             <h2>Gráficos Comparativos</h2>
             <p style='color: #6c757d; font-size: 0.95em;'>
@@ -1243,22 +1666,17 @@ def generate_html_report(stats, analyzer, filename):
     params_ordered = get_params_in_original_order(analyzer, products)
     
     for param in params_ordered:
-        fig = create_detailed_comparison(stats, param)
+        chart_html = _chart_html(stats.key, param, stats)
         
-        if fig:
-            chart_html = fig.to_html(
-                include_plotlyjs=False,
-                div_id=f"graph_{param.replace(' ', '_')}"
-            )
-            
-            html += wrap_chart_in_expandable(
+        if chart_html:
+            yield wrap_chart_in_expandable(
                 chart_html,
                 f"Comparación detallada: {param}",
                 f"chart_{param.replace(' ', '_')}",
                 default_open=True
             )
     
-    html += """
+    yield """
         </div>
     """
     
@@ -1268,14 +1686,14 @@ def generate_html_report(stats, analyzer, filename):
     differences_data = calculate_lamp_differences(stats, analyzer)
     
     if differences_data:
-        html += generate_differences_section(differences_data)
+        yield generate_differences_section(differences_data)
     
     # ============================================
     # SECCIÓN 4: REPORTE DE TEXTO
     # ============================================
     text_report = generate_text_report(stats, analyzer)
     
-    html += f"""
+    yield f"""
         <div class="info-box" id="text-report">
             <h2>Informe Detallado en Texto</h2>
             <p style='color: #6c757d; font-size: 0.95em; margin-bottom: 20px;'>
@@ -1289,7 +1707,7 @@ def generate_html_report(stats, analyzer, filename):
     # ============================================
     # FOOTER
     # ============================================
-    html += f"""
+    yield f"""
         <div class="footer">
             <p><strong>NIR Predictions Analyzer</strong> - Desarrollado para BUCHI</p>
             <p>Reporte generado automáticamente el {timestamp}</p>
@@ -1298,11 +1716,19 @@ def generate_html_report(stats, analyzer, filename):
     </body>
     </html>
     """
-    
-    return html
 
-def generate_text_report(stats, analyzer):
-    """Generar reporte de texto completo con todos los parámetros"""
+
+def generate_text_report(stats, analyzer, generated_at=None, body=None):
+    """
+    Generar reporte de texto completo con todos los parámetros.
+    
+    generated_at es la fecha de la cabecera (por defecto, ahora); body permite
+    reutilizar un cuerpo ya generado con _text_report_body.
+    """
+    if generated_at is None:
+        generated_at = datetime.now()
+    if body is None:
+        body = _text_report_body(stats, analyzer)
     
     report = []
     report.append("=" * 120)
@@ -1310,7 +1736,16 @@ def generate_text_report(stats, analyzer):
     report.append("Análisis de Predicciones - Reporte Completo")
     report.append("=" * 120)
     report.append("")
-    report.append(f"Fecha de generación: {datetime.now().strftime('%d/%m/%Y %H:%M:%S')}")
+    report.append(f"Fecha de generación: {generated_at.strftime('%d/%m/%Y %H:%M:%S')}")
+    report.append(body)
+    
+    return "\n".join(report)
+
+
+def _text_report_body(stats, analyzer):
+    """Cuerpo del reporte de texto (todo lo que sigue a la fecha de generación)"""
+    
+    report = []
     
     # Información del sensor
     if analyzer.sensor_serial:
@@ -1319,10 +1754,7 @@ def generate_text_report(stats, analyzer):
     report.append("")
     
     # Listar lámparas comparadas
-    lamps = set()
-    for product_stats in stats.values():
-        lamps.update(product_stats.keys())
-    lamps = sorted(list(lamps))
+    lamps = stats.all_lamps
     
     report.append("LÁMPARAS COMPARADAS:")
     for lamp in lamps:
@@ -1338,16 +1770,9 @@ def generate_text_report(stats, analyzer):
         
         # Obtener TODOS los parámetros en orden original
         if product in analyzer.data:
-            df = analyzer.data[product]
-            excluded_cols = ['No', 'ID', 'Note', 'Product', 'Method', 'Unit', 'Begin', 'End', 'Length']
-            if len(df.columns) > 1:
-                excluded_cols.append(df.columns[1])
-            params = [col for col in df.columns if col not in excluded_cols]
+            params = get_params(analyzer, product)
         else:
-            params = set()
-            for lamp_stats in product_stats.values():
-                params.update([k for k in lamp_stats.keys() if k not in ['n', 'note']])
-            params = sorted(list(params))
+            params = stats.product_params[product]
         
         report.append("RESULTADOS DE PREDICCIÓN:")
         report.append("")
@@ -1358,11 +1783,12 @@ def generate_text_report(stats, analyzer):
             report.append("  " + "-" * 100)
             
             for param in params:
-                if param in lamp_stats:
-                    mean = lamp_stats[param]['mean']
-                    std = lamp_stats[param]['std']
-                    min_val = lamp_stats[param]['min']
-                    max_val = lamp_stats[param]['max']
+                param_stats = lamp_stats.get(param)
+                if param_stats is not None:
+                    mean = param_stats['mean']
+                    std = param_stats['std']
+                    min_val = param_stats['min']
+                    max_val = param_stats['max']
                     report.append(f"    {param:<25} {mean:>10.3f} ± {std:<8.3f}   (min: {min_val:>8.3f}, max: {max_val:>8.3f})")
             
             report.append("")
@@ -1373,15 +1799,20 @@ def generate_text_report(stats, analyzer):
             report.append("")
             
             # Comparar primera lámpara con las demás
-            base_lamp = sorted(list(product_stats.keys()))[0]
+            product_lamps = sorted(product_stats)
+            base_lamp = product_lamps[0]
+            base_stats = product_stats[base_lamp]
             
-            for lamp in sorted(list(product_stats.keys()))[1:]:
+            for lamp in product_lamps[1:]:
                 report.append(f"    {lamp} vs {base_lamp} (baseline):")
+                comp_stats = product_stats[lamp]
                 
                 for param in params:
-                    if param in product_stats[base_lamp] and param in product_stats[lamp]:
-                        base_mean = product_stats[base_lamp][param]['mean']
-                        comp_mean = product_stats[lamp][param]['mean']
+                    base_param = base_stats.get(param)
+                    comp_param = comp_stats.get(param)
+                    if base_param is not None and comp_param is not None:
+                        base_mean = base_param['mean']
+                        comp_mean = comp_param['mean']
                         diff = comp_mean - base_mean
                         percent_diff = (diff / base_mean * 100) if base_mean != 0 else 0
                         
@@ -1402,31 +1833,22 @@ def generate_text_report(stats, analyzer):
         
         # Obtener parámetros
         if product in analyzer.data:
-            df = analyzer.data[product]
-            excluded_cols = ['No', 'ID', 'Note', 'Product', 'Method', 'Unit', 'Begin', 'End', 'Length']
-            if len(df.columns) > 1:
-                excluded_cols.append(df.columns[1])
-            params = [col for col in df.columns if col not in excluded_cols]
+            params = get_params(analyzer, product)
         else:
-            params = list(stats[product][list(stats[product].keys())[0]].keys())
-            params = [p for p in params if p not in ['n', 'note']]
+            params = list(next(iter(stats.lamp_params[product].values())))
         
         for param in params[:5]:  # Primeros 5 parámetros para resumen
             report.append(f"  {param}:")
             
-            # Calcular estadísticas entre lámparas
-            values = []
-            for lamp_stats in stats[product].values():
-                if param in lamp_stats:
-                    values.append(lamp_stats[param]['mean'])
+            # Calcular estadísticas entre lámparas (desviación poblacional)
+            values = np.fromiter(
+                (lamp_stats[param]['mean'] for lamp_stats in stats[product].values() if param in lamp_stats),
+                dtype=np.float64
+            )
             
-            if values:
-                overall_mean = sum(values) / len(values)
-                overall_std = (sum((x - overall_mean) ** 2 for x in values) / len(values)) ** 0.5
-                overall_range = max(values) - min(values)
-                
-                report.append(f"    Media entre lámparas: {overall_mean:.3f} ± {overall_std:.3f}")
-                report.append(f"    Rango: {overall_range:.3f}")
+            if values.size:
+                report.append(f"    Media entre lámparas: {values.mean():.3f} ± {values.std():.3f}")
+                report.append(f"    Rango: {np.ptp(values):.3f}")
         
         report.append("")
     
@@ -1437,6 +1859,90 @@ def generate_text_report(stats, analyzer):
     return "\n".join(report)
 
 
+@st.cache_data(show_spinner=False, max_entries=SELECTION_CACHE_ENTRIES)
+def _cached_text_report_body(stats_key, _stats, _analyzer):
+    """
+    Cuerpo del reporte de texto cacheado según la huella de las estadísticas,
+    para no regenerarlo al volver a la pestaña; _stats y _analyzer no se hashean.
+    """
+    return _text_report_body(_stats, _analyzer)
+
+
+def _text_report(stats, analyzer, generated_at):
+    """Reporte de texto con la fecha indicada y el cuerpo cacheado"""
+    body = _cached_text_report_body(stats.key, stats, analyzer)
+    return generate_text_report(stats, analyzer, generated_at, body)
+
+
+@st.fragment
+def _tab_detailed(stats, params):
+    """Pestaña de comparación detallada por producto"""
+    st.subheader("Comparación Detallada por Producto")
+    
+    if params:
+        selected_param = st.selectbox(
+            "Selecciona el parámetro a visualizar:",
+            params,
+            key='detailed_param'
+        )
+        
+        fig_detailed = create_detailed_comparison(stats, selected_param)
+        if fig_detailed:
+            st.plotly_chart(fig_detailed, use_container_width=True)
+
+
+@st.fragment
+def _tab_differences(stats):
+    """Pestaña de diferencias relativas entre lámparas"""
+    st.subheader("Diferencias Relativas entre Lámparas")
+    fig_diff = create_comparison_plots(stats)
+    if fig_diff:
+        st.plotly_chart(fig_diff, use_container_width=True)
+
+
+@st.fragment
+def _tab_box_plots(stats, params):
+    """Pestaña de box plots por lámpara"""
+    st.subheader("Distribución de Valores por Lámpara")
+    fig_box = create_box_plots(stats, params)
+    if fig_box:
+        st.plotly_chart(fig_box, use_container_width=True)
+
+
+@st.fragment
+def _tab_text_report(stats, analyzer):
+    """Pestaña del reporte de texto"""
+    st.subheader("Informe Completo en Texto")
+    # Misma fecha en la cabecera del reporte y en el nombre del archivo
+    generated_at = datetime.now()
+    report_text = _text_report(stats, analyzer, generated_at)
+    
+    # Solo lectura: st.code en lugar de un text_area editable;
+    # los reportes muy largos se muestran por páginas
+    report_lines = report_text.splitlines()
+    n_pages = -(-len(report_lines) // REPORT_PAGE_LINES)
+    if n_pages > 1:
+        page = st.selectbox(
+            "Página:",
+            range(n_pages),
+            format_func=lambda i: f"{i + 1} de {n_pages}"
+        )
+        start = page * REPORT_PAGE_LINES
+        report_page = '\n'.join(report_lines[start:start + REPORT_PAGE_LINES])
+    else:
+        report_page = report_text
+    with st.container(height=600):
+        st.code(report_page, language=None)
+    
+    # Botón de descarga
+    st.download_button(
+        label="💾 Descargar Reporte",
+        data=report_text,
+        file_name=f"informe_nir_{generated_at.strftime('%Y%m%d_%H%M%S')}.txt",
+        mime="text/plain"
+    )
+
+
 def main():
     """Función principal de la aplicación Streamlit"""
     
@@ -1481,6 +1987,12 @@ def main():
         st.session_state.filtered_data = None
     if 'stats' not in st.session_state:
         st.session_state.stats = None
+    if 'xml_sig' not in st.session_state:
+        st.session_state.xml_sig = None
+    if 'params_ordered' not in st.session_state:
+        st.session_state.params_ordered = []
+    if 'last_sel_hash' not in st.session_state:
+        st.session_state.last_sel_hash = None
     
     # Sidebar para configuración
     with st.sidebar:
@@ -1496,44 +2008,57 @@ def main():
         if uploaded_file is not None:
             if st.button("📊 Cargar y Analizar"):
                 with st.spinner("Procesando archivo XML..."):
-                    analyzer = NIRAnalyzer()
-                    if analyzer.parse_xml(uploaded_file):
+                    try:
+                        analyzer = load_analyzer(uploaded_file.getvalue())
+                    except Exception as e:
+                        st.error(f"Error al parsear el archivo XML: {str(e)}")
+                        analyzer = None
+                    
+                    if analyzer is not None:
+                        # Archivo nuevo: descartar los resultados de la sesión. Las cachés
+                        # (compartidas entre sesiones) no se vacían: sus claves incluyen
+                        # la huella del archivo y tienen un número máximo de entradas
+                        if analyzer.data_key != st.session_state.xml_sig:
+                            st.session_state.filtered_data = None
+                            st.session_state.stats = None
+                            st.session_state.params_ordered = []
+                            st.session_state.last_sel_hash = None
+                            st.session_state.xml_sig = analyzer.data_key
                         st.session_state.analyzer = analyzer
                         st.success(f"✅ Archivo cargado correctamente!")
                         st.info(f"Productos encontrados: {len(analyzer.products)}")
         
+        # Reiniciar: forzar un nuevo parseo y descartar los resultados de la sesión
+        if st.session_state.analyzer is not None:
+            if st.button("🔄 Reiniciar análisis"):
+                load_analyzer.clear()
+                for key in ('analyzer', 'filtered_data', 'stats', 'xml_sig', 'last_sel_hash'):
+                    st.session_state[key] = None
+                st.session_state.params_ordered = []
+                st.rerun()
+        
         # Botón de descarga de reporte HTML (solo si hay estadísticas)
         if st.session_state.stats is not None and st.session_state.analyzer is not None:
             st.markdown("---")
             st.subheader("📥 Descargar Reporte")
             
-            # Generar nombre del archivo
             analyzer = st.session_state.analyzer
             stats = st.session_state.stats
             
-            # Obtener lámparas seleccionadas
-            all_lamps = set()
-            for product_stats in stats.values():
-                all_lamps.update(product_stats.keys())
-            lamps_str = "_".join(sorted(all_lamps))
-            
-            # Obtener número de serie
-            sensor_serial = analyzer.sensor_serial if analyzer.sensor_serial else "sensor"
-            
-            # Timestamp
-            timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
-            
-            # Nombre del archivo
-            filename = f"Predictions_Report_{sensor_serial}_{lamps_str}_{timestamp}.html"
-            
             if st.button("💾 Generar y Descargar Reporte HTML"):
+                # Generar nombre del archivo (solo al pulsar el botón)
+                lamps_str = "_".join(stats.all_lamps)
+                sensor_serial = analyzer.sensor_serial if analyzer.sensor_serial else "sensor"
+                timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
+                filename = f"Predictions_Report_{sensor_serial}_{lamps_str}_{timestamp}.html"
+                
                 with st.spinner("Generando reporte HTML..."):
                     # Generar HTML completo con todos los gráficos
                     html_content = generate_html_report(stats, analyzer, filename)
                     
                     st.download_button(
                         label="⬇️ Descargar Reporte HTML",
-                        data=html_content,
+                        data=html_content.encode('utf-8'),
                         file_name=filename,
                         mime="text/html"
                     )
@@ -1557,18 +2082,8 @@ def main():
         )
         
         if selected_products:
-            # Obtener IDs y Notes únicos
-            all_ids = set()
-            all_notes = set()
-            
-            for product in selected_products:
-                if product in analyzer.data:
-                    df = analyzer.data[product]
-                    all_ids.update(df['ID'].dropna().unique())
-                    all_notes.update(df['Note'].dropna().unique())
-            
-            all_ids = sorted(list(all_ids))
-            all_notes = sorted(list(all_notes))
+            # Obtener IDs y Notes únicos (cacheado por archivo y productos)
+            all_ids, all_notes = analyzer.get_ids_and_notes(selected_products)
             
             st.subheader("2️⃣ Selección de IDs y Lámparas (Notes)")
             
@@ -1598,7 +2113,15 @@ def main():
             
             if selected_combinations:
                 # Botón para generar análisis
-                if st.button("🚀 Generar Análisis y Gráficos", type="primary"):
+                # Huella de la selección: si no cambia, el análisis guardado sigue valiendo
+                sel_hash = hash((
+                    st.session_state.xml_sig,
+                    tuple(selected_products),
+                    tuple(sorted(selected_combinations))
+                ))
+                
+                if (st.button("🚀 Generar Análisis y Gráficos", type="primary")
+                        and sel_hash != st.session_state.last_sel_hash):
                     with st.spinner("Generando análisis..."):
                         # Filtrar datos
                         filtered_data = analyzer.filter_data(selected_products, selected_combinations)
@@ -1608,6 +2131,10 @@ def main():
                         stats = analyzer.calculate_statistics(filtered_data)
                         st.session_state.stats = stats
                         
+                        # Parámetros en orden original (se reutilizan en cada rerun)
+                        st.session_state.params_ordered = get_params_in_original_order(analyzer, list(stats.keys()))
+                        st.session_state.last_sel_hash = sel_hash
+                        
                         st.success("✅ Análisis completado!")
                 
                 # Mostrar resultados si existen
@@ -1615,10 +2142,7 @@ def main():
                     stats = st.session_state.stats
                     
                     # Mostrar lámparas seleccionadas
-                    all_lamps = set()
-                    for product_stats in stats.values():
-                        all_lamps.update(product_stats.keys())
-                    all_lamps = sorted(list(all_lamps))
+                    all_lamps = stats.all_lamps
                     
                     if all_lamps:
                         st.info(f"🔬 **Lámparas seleccionadas:** {', '.join(all_lamps)}")
@@ -1634,47 +2158,18 @@ def main():
                         "📄 Reporte de Texto"
                     ])
                     
+                    # Cada pestaña es un fragmento: sus widgets solo re-ejecutan esa pestaña
                     with tab1:
-                        st.subheader("Comparación Detallada por Producto")
-                        
-                        # Obtener parámetros en orden original
-                        params = get_params_in_original_order(analyzer, list(stats.keys()))
-                        
-                        if params:
-                            selected_param = st.selectbox(
-                                "Selecciona el parámetro a visualizar:",
-                                params,
-                                key='detailed_param'
-                            )
-                            
-                            fig_detailed = create_detailed_comparison(stats, selected_param)
-                            if fig_detailed:
-                                st.plotly_chart(fig_detailed, use_container_width=True)
+                        _tab_detailed(stats, st.session_state.params_ordered)
                     
                     with tab2:
-                        st.subheader("Diferencias Relativas entre Lámparas")
-                        fig_diff = create_comparison_plots(stats)
-                        if fig_diff:
-                            st.plotly_chart(fig_diff, use_container_width=True)
+                        _tab_differences(stats)
                     
                     with tab3:
-                        st.subheader("Distribución de Valores por Lámpara")
-                        fig_box = create_box_plots(stats, analyzer)
-                        if fig_box:
-                            st.plotly_chart(fig_box, use_container_width=True)
+                        _tab_box_plots(stats, st.session_state.params_ordered)
                     
                     with tab4:
-                        st.subheader("Informe Completo en Texto")
-                        report_text = generate_text_report(stats, analyzer)
-                        st.text_area("Reporte:", report_text, height=600)
-                        
-                        # Botón de descarga
-                        st.download_button(
-                            label="💾 Descargar Reporte",
-                            data=report_text,
-                            file_name=f"informe_nir_{datetime.now().strftime('%Y%m%d_%H%M%S')}.txt",
-                            mime="text/plain"
-                        )
+                        _tab_text_report(stats, analyzer)
     
     else:
         st.info("👈 Por favor, carga un archivo XML desde la barra lateral para comenzar el análisis")
@@ -3,6 +3,8 @@ Configuración de estilos corporativos Buchi para Streamlit
 Aplicar al inicio de tu app con: apply_buchi_styles()
 """
 
+import os
+
 import streamlit as st
 
 # Colores corporativos Buchi
@@ -18,6 +20,24 @@ BUCHI_COLORS = {
     'gris_claro': '#F8F9FA'
 }
 
+# Hoja de estilos corporativa (colores vía variables --buchi-*)
+_CSS_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'buchi_streamlit_theme.css')
+
+
+def _build_buchi_css():
+    """Construye el bloque <style>: variables de color + hoja estática"""
+    variables = '\n'.join(
+        f"    --buchi-{name.replace('_', '-')}: {color};"
+        for name, color in BUCHI_COLORS.items()
+    )
+    with open(_CSS_PATH, 'r', encoding='utf-8') as f:
+        css = f.read()
+    return f"<style>\n:root {{\n{variables}\n}}\n{css}</style>"
+
+
+# CSS corporativo: se construye una sola vez al importar el módulo
+_BUCHI_CSS = _build_buchi_css()
+
 def apply_buchi_styles():
     """
     Aplica los estilos base corporativos de Buchi:
@@ -27,370 +47,9 @@ def apply_buchi_styles():
     - Sidebar: Fondo verde oscuro (#093A34) con texto blanco
     - Parche: corrige icono roto de los expanders de Streamlit
     """
-    st.markdown(f"""
-        <style>
-        /* ===== CONFIGURACIÓN GENERAL ===== */
-        * {{
-            font-family: Helvetica, Arial, sans-serif !important;
-        }}
-        
-        .stApp {{
-            background-color: {BUCHI_COLORS['blanco']};
-            color: {BUCHI_COLORS['negro']};
-        }}
-        
-        /* ===== TÍTULOS ===== */
-        h1, h2, h3, h4, h5, h6 {{
-            color: {BUCHI_COLORS['negro']} !important;
-        }}
-        
-        /* ===== TEXTO GENERAL ===== */
-        p, span, div, label {{
-            color: {BUCHI_COLORS['negro']} !important;
-        }}
-        
-        /* ===== SIDEBAR - VERDE OSCURO CON TEXTO BLANCO ===== */
-        [data-testid="stSidebar"] {{
-            background-color: {BUCHI_COLORS['verde_oscuro']} !important;
-        }}
-        
-        /* Todo el texto de la sidebar en blanco */
-        [data-testid="stSidebar"] *,
-        [data-testid="stSidebar"] h1,
-        [data-testid="stSidebar"] h2,
-        [data-testid="stSidebar"] h3,
-        [data-testid="stSidebar"] h4,
-        [data-testid="stSidebar"] h5,
-        [data-testid="stSidebar"] h6,
-        [data-testid="stSidebar"] p,
-        [data-testid="stSidebar"] span,
-        [data-testid="stSidebar"] label,
-        [data-testid="stSidebar"] div {{
-            color: {BUCHI_COLORS['blanco']} !important;
-        }}
-        
-        /* Labels de inputs en sidebar */
-        [data-testid="stSidebar"] .stTextInput label,
-        [data-testid="stSidebar"] .stNumberInput label,
-        [data-testid="stSidebar"] .stSelectbox label,
-        [data-testid="stSidebar"] .stMultiSelect label,
-        [data-testid="stSidebar"] .stTextArea label {{
-            color: {BUCHI_COLORS['blanco']} !important;
-        }}
-        
-        /* ⭐ NUEVO: Texto de ayuda/placeholder en File Uploader - NEGRO */
-        [data-testid="stSidebar"] .stFileUploader small,
-        [data-testid="stSidebar"] .stFileUploader [data-testid="stMarkdownContainer"],
-        [data-testid="stSidebar"] .stFileUploader p {{
-            color: {BUCHI_COLORS['blanco']} !important;
-        }}
-
-        /* ⭐ NUEVO: Área del drag & drop - fondo blanco con texto negro */
-        [data-testid="stSidebar"] .stFileUploader > div {{
-            background-color: {BUCHI_COLORS['blanco']} !important;
-            border-radius: 8px;
-            padding: 1rem;
-        }}
-        
-        /* ===== BOTONES ===== */
-        /* Botones NORMALES - Verde oscuro con texto blanco */
-        .stButton > button {{
-            background-color: {BUCHI_COLORS['verde_oscuro']};
-            color: {BUCHI_COLORS['blanco']};
-            border: none;
-            border-radius: 10px;
-            padding: 10px 20px;
-            font-weight: bold;
-            transition: all 0.3s ease;
-        }}
-
-        .stButton > button:hover {{
-            background-color: {BUCHI_COLORS['verde_turquesa']};
-        }}
-
-        .stButton > button * {{
-            color: {BUCHI_COLORS['blanco']} !important;
-        }}
-
-        /* Botones PRIMARY (Guardar y Continuar, etc) - VERDE */
-        .stButton > button[data-testid="stBaseButton-primary"],
-        button[data-testid="stBaseButton-primary"],
-        .stFormSubmitButton > button {{
-            background-color: {BUCHI_COLORS['verde_principal']} !important;
-            color: {BUCHI_COLORS['blanco']} !important;
-            border: none !important;
-        }}
-
-        .stButton > button[data-testid="stBaseButton-primary"]:hover,
-        .stFormSubmitButton > button:hover {{
-            background-color: {BUCHI_COLORS['verde_turquesa']} !important;
-        }}
-
-        .stFormSubmitButton > button *,
-        .stButton > button[data-testid="stBaseButton-primary"] *,
-        button[data-testid="stBaseButton-primary"] * {{
-            color: {BUCHI_COLORS['blanco']} !important;
-        }}
-
-        /* Botones SECONDARY en SIDEBAR (navegación pasos) - VERDE */
-        [data-testid="stSidebar"] button[data-testid="stBaseButton-secondary"] {{
-            background-color: {BUCHI_COLORS['verde_principal']} !important;
-            color: {BUCHI_COLORS['blanco']} !important;
-            border: none !important;
-            text-align: left !important;
-        }}
-
-        [data-testid="stSidebar"] button[data-testid="stBaseButton-secondary"]:hover {{
-            background-color: {BUCHI_COLORS['verde_turquesa']} !important;
-        }}
-
-        [data-testid="stSidebar"] button[data-testid="stBaseButton-secondary"] * {{
-            color: {BUCHI_COLORS['blanco']} !important;
-        }}
-
-        /* Botones SECONDARY en MAIN - Blanco con borde (GENÉRICO) */
-        section[data-testid="stMain"] button[data-testid="stBaseButton-secondary"] {{
-            background-color: {BUCHI_COLORS['blanco']} !important;
-            color: {BUCHI_COLORS['negro']} !important;
-            border: 2px solid {BUCHI_COLORS['verde_principal']} !important;
-        }}
-
-        section[data-testid="stMain"] button[data-testid="stBaseButton-secondary"]:hover {{
-            background-color: {BUCHI_COLORS['gris_claro']} !important;
-            border-color: {BUCHI_COLORS['verde_turquesa']} !important;
-        }}
-
-        section[data-testid="stMain"] button[data-testid="stBaseButton-secondary"] * {{
-            color: {BUCHI_COLORS['negro']} !important;
-        }}
-
-        /* Botón Cerrar Sesión específico - sobrescribe secondary en main */
-        section[data-testid="stMain"] .st-key-logout_btn button[data-testid="stBaseButton-secondary"] {{
-            background-color: {BUCHI_COLORS['verde_oscuro']} !important;
-            color: {BUCHI_COLORS['blanco']} !important;
-            border: none !important;
-        }}
-
-        section[data-testid="stMain"] .st-key-logout_btn button[data-testid="stBaseButton-secondary"]:hover {{
-            background-color: {BUCHI_COLORS['verde_turquesa']} !important;
-        }}
-
-        section[data-testid="stMain"] .st-key-logout_btn button[data-testid="stBaseButton-secondary"] * {{
-            color: {BUCHI_COLORS['blanco']} !important;
-        }}
-        
-        /* ===== INPUTS ===== */
-        .stTextInput > div > div > input,
-        .stNumberInput > div > div > input,
-        .stTextArea > div > div > textarea {{
-            border-radius: 5px;
-            border: 1px solid #ddd;
-        }}
-        
-        /* ===== DATAFRAME ===== */
-        .stDataFrame {{
-            background-color: {BUCHI_COLORS['blanco']};
-        }}
-        
-        /* ===== TABS ===== */
-        .stTabs [data-baseweb="tab"] {{
-            color: {BUCHI_COLORS['negro']};
-        }}
-        
-        .stTabs [aria-selected="true"] {{
-            background-color: {BUCHI_COLORS['verde_principal']};
-            color: {BUCHI_COLORS['blanco']} !important;
-        }}
-
-        /* ===== EXPANDERS =====
-           Parche global para ocultar 'keyboard_arrow_*'
-           y dibujar una flecha consistente en local y en streamlit.io
-        */
-
-        /* --- CASO STREAMLIT CLOUD (usa <details><summary>...) --- */
-
-        /* 1. Oculta el span con data-testid="stIconMaterial" dentro del summary */
-        details > summary [data-testid="stIconMaterial"] {{
-            display: none !important;
-            visibility: hidden !important;
-        }}
-
-        /* 2. Ajusta el summary para posicionar nuestra flecha propia */
-        details > summary {{
-            position: relative !important;
-            list-style: none !important; /* quita el triángulo por defecto de <summary> en algunos navegadores */
-            padding-right: 2rem !important;
-            cursor: pointer;
-            display: flex !important;
-            align-items: center !important;
-            gap: 0.5rem !important;
-            color: inherit !important;
-        }}
-
-        /* 3. Flecha cuando el expander está cerrado (details SIN open) */
-        details:not([open]) > summary::after {{
-            content: "▾";
-            position: absolute;
-            right: 0.75rem;
-            top: 50%;
-            transform: translateY(-50%);
-            font-size: 1rem;
-            font-weight: 400;
-            color: {BUCHI_COLORS['negro']};
-        }}
-
-        /* 4. Flecha cuando está abierto (details[open]) */
-        details[open] > summary::after {{
-            content: "▴";
-            position: absolute;
-            right: 0.75rem;
-            top: 50%;
-            transform: translateY(-50%);
-            font-size: 1rem;
-            font-weight: 400;
-            color: {BUCHI_COLORS['negro']};
-        }}
-
-        /* 5. Asegura que el texto del título siga visible
-              (Streamlit mete el título dentro de <div data-testid="stMarkdownContainer"><p>...</p></div>)
-              No lo tocamos de color para no pelear con tus overrides globales,
-              pero garantizamos que no colapse por herencia de font-size:0 de reglas anteriores.
-        */
-        details > summary [data-testid="stMarkdownContainer"],
-        details > summary [data-testid="stMarkdownContainer"] * {{
-            font-size: inherit !important;
-            line-height: inherit !important;
-            color: inherit !important;
-            visibility: visible !important;
-            display: block !important;
-        }}
-
-        /* --- CASO LOCAL (usa div[data-testid="stExpander"] ... role="button") --- */
-
-        /* Asegura layout tipo flex en local */
-        div[data-testid="stExpander"] > div[role="button"] {{
-            display: flex !important;
-            align-items: center !important;
-            position: relative !important;
-            padding-right: 2rem !important;
-            min-height: 2rem;
-            line-height: 1.4;
-            gap: 0.5rem !important;
-            color: inherit !important;
-        }}
-
-        /* Oculta el span con el icono roto en local */
-        div[data-testid="stExpander"] > div[role="button"] span[data-testid="stIconMaterial"] {{
-            display: none !important;
-            visibility: hidden !important;
-        }}
-
-        /* Evita que se vea texto como 'keyboard_arrow_down' en spans sueltos */
-        div[data-testid="stExpander"] > div[role="button"] span {{
-            font-size: 0 !important;
-            line-height: 0 !important;
-            color: transparent !important;
-            width: 0 !important;
-            height: 0 !important;
-            overflow: hidden !important;
-            display: inline-block !important;
-        }}
-
-        /* Rehabilita el texto bueno (el título) donde Streamlit lo pone normalmente */
-        div[data-testid="stExpander"] > div[role="button"] p,
-        div[data-testid="stExpander"] > div[role="button"] div[data-testid="stMarkdownContainer"],
-        div[data-testid="stExpander"] > div[role="button"] div[data-testid="stMarkdownContainer"] * {{
-            font-size: inherit !important;
-            line-height: inherit !important;
-            color: inherit !important;
-            width: auto !important;
-            height: auto !important;
-            overflow: visible !important;
-            display: inline-block !important;
-            visibility: visible !important;
-        }}
-
-        /* Flecha custom en local (aria-expanded false/true) */
-        div[data-testid="stExpander"] > div[role="button"][aria-expanded="false"]::after {{
-            content: "▾";
-            position: absolute;
-            right: 0.75rem;
-            top: 50%;
-            transform: translateY(-50%);
-            font-size: 1rem;
-            font-weight: 400;
-            color: {BUCHI_COLORS['negro']};
-        }}
-
-        div[data-testid="stExpander"] > div[role="button"][aria-expanded="true"]::after {{
-            content: "▴";
-            position: absolute;
-            right: 0.75rem;
-            top: 50%;
-            transform: translateY(-50%);
-            font-size: 1rem;
-            font-weight: 400;
-            color: {BUCHI_COLORS['negro']};
-        }}
-
-        /* ===== FIX ICONO MATERIAL EN SIDEBAR =====
-           En Streamlit Cloud a veces aparece el texto literal "keyboard_arrow_right"
-           o "keyboard_arrow_down" dentro de span[data-testid="stIconMaterial"].
-           Lo ocultamos y lo reemplazamos por una flecha simple que no depende de Material Icons.
-        */
-
-        [data-testid="stSidebar"] span[data-testid="stIconMaterial"] {{
-            font-size: 0 !important;
-            line-height: 0 !important;
-            color: transparent !important;
-        }}
-
-        /* Si el span roto está dentro de la sidebar, añadimos nuestra flecha decorativa */
-        [data-testid="stSidebar"] span[data-testid="stIconMaterial"]::after {{
-            content: "›";
-            font-size: 0.9rem;
-            line-height: 1rem;
-            color: #FFFFFF; /* Blanco porque tu sidebar es verde oscuro */
-            display: inline-block;
-            vertical-align: middle;
-        }}
-        
-                /* ===== FIX ICONO MATERIAL DEL TOGGLE DE SIDEBAR (MODO COLAPSADO) =====
-           En streamlit.io, cuando la sidebar está plegada aparece un botón flotante
-           para volver a abrirla. Ese botón muestra texto literal
-           tipo "keyboard_double_arrow_right" en vez del icono material.
-           Aquí lo ocultamos y metemos una flecha estable.
-        */
-
-        /* 1. Ocultamos el texto crudo del icono material en el botón flotante */
-        button span[data-testid="stIconMaterial"] {{
-            font-size: 0 !important;
-            line-height: 0 !important;
-            color: transparent !important;
-        }}
-
-        /* 2. Añadimos nuestra flecha por defecto (abrir sidebar) */
-        button span[data-testid="stIconMaterial"]::after {{
-            content: "▸";
-            font-size: 1rem;
-            line-height: 1rem;
-            color: {BUCHI_COLORS['negro']};
-            display: inline-block;
-            vertical-align: middle;
-        }}
-
-        /* 3. Si el botón está dentro del propio sidebar (expanded),
-              usamos la versión blanca, no negra */
-        [data-testid="stSidebar"] button span[data-testid="stIconMaterial"]::after {{
-            content: "▸";
-            color: #FFFFFF;
-        }}
-
-
-
-
-        </style>
-    """, unsafe_allow_html=True)
+    # Se emite en cada rerun: Streamlit descarta los elementos no re-emitidos,
+    # así que no se puede saltar con una marca en session_state
+    st.markdown(_BUCHI_CSS, unsafe_allow_html=True)
 
 
 def add_custom_css(custom_css):
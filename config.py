@@ -1,3 +1,4 @@
+# -*- coding: latin-1 -*-
 # config.py - Configuracin corporativa BUCHI
 
 # Colores corporativos